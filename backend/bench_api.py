@@ -0,0 +1,296 @@
+"""Load-test the API in-process and report throughput and latency per route.
+
+Seeds a throwaway database (--db, default "bench") with synthetic cars,
+wiping its cars, inquiries and contacts first, then drives concurrent
+async clients through a weighted mix of routes for a fixed duration
+and prints requests/s and p50/p95/p99 latency for each. Pass --save to
+store the report as a baseline and --baseline to fail (exit 1) when a
+route's p95 or throughput regresses by more than --threshold. Seeding
+refuses to touch a database holding cars whose stock number does not
+start with BENCH- unless --force is given.
+
+Usage:
+    python bench_api.py [--cars 10000] [--concurrency 32] [--duration 30]
+                        [--db bench] [--force] [--mongo-url mongodb://localhost:27017] [--mock]
+                        [--save baseline.json] [--baseline baseline.json] [--threshold 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# Background jobs and throttling would skew or reject the measured traffic
+os.environ.setdefault("RATE_LIMITING", "false")
+os.environ.setdefault("PRICING_REFRESH_INTERVAL", "0")
+os.environ.setdefault("AUTO_INDEXES", "false")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+# Only so server imports without a .env; the benchmark always uses --db
+os.environ.setdefault("DB_NAME", "bench")
+os.environ.setdefault("ADMIN_TOKEN_SECRET", "bench-only-secret-never-used-in-production")
+
+import httpx
+import numpy as np
+
+import server
+
+BRANDS = {
+    "Porsche": ["911 Carrera", "Cayenne", "Taycan", "Macan"],
+    "Mercedes-Benz": ["AMG GT", "G63 AMG", "S 580", "EQS"],
+    "BMW": ["M4 Competition", "X7 M50i", "i7", "M5"],
+    "Audi": ["RS7 Sportback", "R8", "e-tron GT", "Q8"],
+    "Toyota": ["Land Cruiser", "Supra", "Camry", "RAV4"],
+    "Ford": ["Mustang", "F-150 Raptor", "Bronco", "Explorer"],
+    "Tesla": ["Model S Plaid", "Model X", "Model 3", "Model Y"],
+    "Land Rover": ["Range Rover", "Defender", "Discovery", "Velar"],
+}
+BODY_TYPES = ["Sedan", "SUV", "Coupe", "Sports", "Convertible"]
+FUEL_TYPES = ["Petrol", "Diesel", "Electric", "Hybrid"]
+FEATURES = [
+    "Sport Chrono", "Carbon Ceramics", "Heated Seats", "Navigation", "Panoramic Roof",
+    "Burmester Sound", "Adaptive Cruise", "Night Vision", "Massage Seats", "Towing Package",
+    "Head-Up Display", "Air Suspension", "Lane Assist", "Nappa Leather", "Sport Exhaust",
+]
+MIN_SAMPLES = 50
+STOCK_PREFIX = "BENCH-"
+WORDS = "immaculate full service history one owner warranty carbon leather premium sport package low mileage".split()
+
+
+def make_cars(count: int, rng: random.Random) -> list:
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    cars = []
+    for i in range(count):
+        brand = rng.choice(list(BRANDS))
+        fuel = rng.choice(FUEL_TYPES)
+        cars.append({
+            "id": str(uuid.uuid4()),
+            "brand": brand,
+            "brand_key": server.brand_key(brand),
+            "model": rng.choice(BRANDS[brand]),
+            "year": rng.randint(2008, 2025),
+            "price": float(rng.randrange(15000, 350000, 500)),
+            "mileage": rng.randrange(0, 180000, 100),
+            "fuel_type": fuel,
+            "transmission": rng.choice(["Automatic", "Automatic", "Manual"]),
+            "body_type": rng.choice(BODY_TYPES),
+            "color": rng.choice(["Black", "White", "Silver", "Blue", "Red", "Grey"]),
+            "engine": "Electric" if fuel == "Electric" else rng.choice(["2.0L I4", "3.0L I6", "4.0L V8", "5.2L V10"]),
+            "description": " ".join(rng.choices(WORDS, k=20)),
+            "features": rng.sample(FEATURES, 5),
+            "images": [f"https://images.example.com/{i}.jpg"],
+            "is_featured": rng.random() < 0.02,
+            "status": rng.choices(["available", "sold", "reserved"], weights=[80, 15, 5])[0],
+            "stock_number": f"{STOCK_PREFIX}{i:07d}",
+            "version": 0,
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now - timedelta(minutes=i),
+        })
+    return cars
+
+
+async def foreign_cars() -> int:
+    """Cars in the target database that a previous benchmark did not seed."""
+    return await server.db.cars.count_documents({"stock_number": {"$not": {"$regex": f"^{STOCK_PREFIX}"}}})
+
+
+async def seed(count: int, rng: random.Random) -> list:
+    await server.db.cars.delete_many({})
+    await server.db.inquiries.delete_many({})
+    await server.db.contacts.delete_many({})
+    await server.db.meta.delete_many({})
+    await server.db.stats.delete_many({})
+    cars = make_cars(count, rng)
+    for start in range(0, count, 5000):
+        await server.db.cars.insert_many([dict(car) for car in cars[start:start + 5000]], ordered=False)
+    await server.touch_catalog()
+    return [car["id"] for car in cars]
+
+
+def scenarios(car_ids: list, rng: random.Random) -> dict:
+    """Route name -> (weight, request factory returning (method, url, json))."""
+    brands = [server.brand_key(brand)[:4] for brand in BRANDS]
+    inquiry = lambda: {
+        "car_id": rng.choice(car_ids), "name": "Bench", "email": "bench@example.com",
+        "phone": "+10000000000", "message": "Is this still available?",
+    }
+    return {
+        "cars:list": (10, lambda: ("GET", "/api/cars?limit=20", None)),
+        "cars:list_filtered": (15, lambda: ("GET", "/api/cars", {
+            "params": rng.choice([
+                {"brand": rng.choice(brands), "limit": 20},
+                {"body_type": rng.choice(BODY_TYPES), "status": "available", "limit": 20},
+                {"min_price": 50000, "max_price": 150000, "limit": 20},
+                {"fuel_type": rng.choice(FUEL_TYPES), "min_year": 2018, "limit": 20},
+            ]),
+        })),
+        "cars:list_summary_page": (10, lambda: ("GET", "/api/cars?paginate=true&fields=summary&limit=24", None)),
+        "cars:detail": (20, lambda: ("GET", f"/api/cars/{rng.choice(car_ids)}", None)),
+        "cars:featured": (5, lambda: ("GET", "/api/cars/featured", None)),
+        "cars:brands": (3, lambda: ("GET", "/api/cars/brands", None)),
+        "cars:stats": (3, lambda: ("GET", "/api/cars/stats", None)),
+        "cars:facets": (5, lambda: ("GET", "/api/cars/facets", {"params": {"body_type": rng.choice(BODY_TYPES)}})),
+        "cars:search": (8, lambda: ("GET", "/api/cars/search", {
+            "params": {"q": rng.choice(["v8 coupe", "carbon", "porsche", "leather sport", "merc"])},
+        })),
+        "cars:similar": (5, lambda: ("GET", f"/api/cars/{rng.choice(car_ids)}/similar", None)),
+        "inquiries:create": (5, lambda: ("POST", "/api/inquiries", {"json": inquiry()})),
+        "inquiries:list": (2, lambda: ("GET", "/api/inquiries", None)),
+        "inquiries:stats": (2, lambda: ("GET", "/api/inquiries/stats", None)),
+        "contact:create": (2, lambda: ("POST", "/api/contact", {"json": {
+            "name": "Bench", "email": "bench@example.com", "message": "Call me back",
+        }})),
+    }
+
+
+async def drive(client: httpx.AsyncClient, mix: dict, deadline: float, rng: random.Random, samples: dict):
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        method, url, options = mix[name][1]()
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **(options or {}))
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - start
+        latencies, errors = samples.setdefault(name, ([], [0]))
+        latencies.append(elapsed)
+        if not ok:
+            errors[0] += 1
+
+
+def summarize(samples: dict, duration: float) -> dict:
+    report = {}
+    for name in sorted(samples):
+        latencies, errors = samples[name]
+        millis = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(millis, [50, 95, 99])
+        report[name] = {
+            "requests": len(latencies),
+            "errors": errors[0],
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+        }
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, current in report["routes"].items():
+        before = baseline["routes"].get(name)
+        # Percentiles over a handful of requests are noise, not a regression
+        if not before or min(before["requests"], current["requests"]) < MIN_SAMPLES:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {current['p95_ms']} ms")
+        if current["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {before['rps']} -> {current['rps']} req/s")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{report['config']['cars']} cars, concurrency {report['config']['concurrency']}, "
+          f"{report['config']['duration']}s, {report['total_rps']} req/s overall")
+    print(f"{'route':<26}{'reqs':>8}{'errs':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, row in report["routes"].items():
+        print(f"{name:<26}{row['requests']:>8}{row['errors']:>6}{row['rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+
+
+async def main(args) -> int:
+    if args.mock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            print("--mock needs mongomock-motor installed", file=sys.stderr)
+            return 2
+        server.client = AsyncMongoMockClient(tz_aware=True)
+    elif args.mongo_url:
+        # Keep production's metrics and slow-query listeners in the measured path
+        server.client = server.AsyncIOMotorClient(args.mongo_url, tz_aware=True, event_listeners=server.listeners)
+    server.db = server.client[args.db]
+
+    if not args.force:
+        foreign = await foreign_cars()
+        if foreign:
+            print(f"Refusing to seed {args.db!r}: it holds {foreign} cars not created by this benchmark "
+                  f"(stock number not starting with {STOCK_PREFIX}). Pass --force to wipe them.", file=sys.stderr)
+            return 2
+
+    rng = random.Random(args.seed)
+    print(f"Seeding {args.cars} cars into {args.db}...")
+    if not args.mock:
+        await server.ensure_indexes()
+    car_ids = await seed(args.cars, rng)
+    await server.app.router.startup()
+    await server.catalog_indexes.sync(await server.catalog_version())
+
+    mix = scenarios(car_ids, rng)
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        # The inquiry list and stats are admin reads, so every client carries a session token
+        headers = {"Authorization": f"Bearer {server.issue_session('bench')['access_token']}"}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            # One untimed pass per route fills caches and the search index
+            for _, factory in mix.values():
+                method, url, options = factory()
+                await client.request(method, url, **(options or {}))
+
+            samples = {}
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                drive(client, mix, deadline, random.Random(args.seed + worker), samples)
+                for worker in range(args.concurrency)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        await server.app.router.shutdown()
+
+    routes = summarize(samples, elapsed)
+    report = {
+        "config": {"cars": args.cars, "concurrency": args.concurrency, "duration": args.duration, "mock": args.mock},
+        "total_rps": round(sum(row["requests"] for row in routes.values()) / elapsed, 1),
+        "routes": routes,
+    }
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(report, json.load(handle), args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default="bench", help="Database to seed and benchmark; its cars, inquiries and contacts are wiped")
+    parser.add_argument("--force", action="store_true", help="Seed even if the database holds non-benchmark cars")
+    parser.add_argument("--mongo-url", help="Defaults to MONGO_URL")
+    parser.add_argument("--mock", action="store_true", help="Use mongomock-motor instead of a mongod")
+    parser.add_argument("--save", help="Write the report here as a new baseline")
+    parser.add_argument("--baseline", help="Compare against a saved report")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p95/throughput regression (0.2 = 20%%)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
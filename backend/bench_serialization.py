@@ -0,0 +1,84 @@
+"""Compare FastAPI's default response serialization with the FAST_RESPONSES path.
+
+Usage: python bench_serialization.py [--cars 100] [--rounds 200]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import server
+
+
+def make_docs(count: int) -> list:
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    docs = []
+    for i in range(count):
+        docs.append({
+            "brand": "Mercedes-Benz",
+            "brand_key": "mercedes-benz",
+            "model": f"AMG GT {i}",
+            "year": 2015 + i % 9,
+            "price": 50000 + i * 250,
+            "mileage": 1000 * (i % 90),
+            "fuel_type": "Petrol",
+            "transmission": "Automatic",
+            "body_type": "Coupe",
+            "color": "Selenite Grey",
+            "engine": "4.0L V8 Biturbo",
+            "description": "Pure driving excitement with the AMG Aerodynamic Package. " * 3,
+            "features": ["AMG Aero Package", "Burmester High-End", "Nappa Leather"],
+            "images": [f"/api/images/{uuid.uuid4().hex}" for _ in range(4)],
+            "is_featured": i % 5 == 0,
+            "status": "available",
+            "id": str(uuid.uuid4()),
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now,
+        })
+    return docs
+
+
+async def default_path(field, docs) -> bytes:
+    content = await serialize_response(field=field, response_content=docs, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+def fast_path(docs) -> bytes:
+    return server.fast_json(server._car_list, docs).body
+
+
+async def main(cars: int, rounds: int):
+    docs = make_docs(cars)
+    field = create_response_field(name="Response_get_cars", type_=List[server.Car], mode="serialization")
+
+    baseline = await default_path(field, docs)
+    fast = fast_path(docs)
+    assert baseline == fast, "fast path output differs from FastAPI's"
+
+    start = time.process_time()
+    for _ in range(rounds):
+        await default_path(field, docs)
+    default_cpu = (time.process_time() - start) / rounds
+
+    start = time.process_time()
+    for _ in range(rounds):
+        fast_path(docs)
+    fast_cpu = (time.process_time() - start) / rounds
+
+    print(f"{cars} cars, {len(baseline)} bytes, byte-identical output")
+    print(f"default: {default_cpu * 1000:.3f} ms CPU/request")
+    print(f"fast:    {fast_cpu * 1000:.3f} ms CPU/request ({default_cpu / fast_cpu:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.cars, args.rounds))
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import typer
+
+import server
+
+cli = typer.Typer(help="Velocità Motors maintenance commands")
+
+
+def run(coro):
+    try:
+        return asyncio.run(coro)
+    finally:
+        server.client.close()
+
+
+@cli.callback()
+def main():
+    pass
+
+
+@cli.command()
+def indexes(
+    apply: bool = typer.Option(False, "--apply", help="Create missing and rebuild mismatched indexes"),
+    drop_extra: bool = typer.Option(False, "--drop-extra", help="Drop indexes not in INDEX_SPECS (implies --apply)"),
+):
+    """Show existing indexes versus INDEX_SPECS, optionally reconciling them."""
+    if apply or drop_extra:
+        report = run(server.ensure_indexes(drop_extra=drop_extra))
+    else:
+        report = run(server.index_report())
+    typer.echo(json.dumps(report, indent=2))
+
+
+@cli.command("backfill-brand-keys")
+def backfill_brand_keys(batch_size: int = typer.Option(1000, help="Updates per bulk_write")):
+    """Populate brand_key on cars created before it existed."""
+    updated = run(server.backfill_brand_keys(batch_size))
+    typer.echo(f"Updated brand_key on {updated} cars")
+
+
+@cli.command("migrate-timestamps")
+def migrate_timestamps(batch_size: int = typer.Option(1000, help="Documents converted per bulk_write")):
+    """Convert ISO-string created_at/updated_at fields to BSON dates."""
+    converted = run(server.migrate_timestamps(batch_size))
+    typer.echo(json.dumps(converted, indent=2))
+
+
+@cli.command("check-stats")
+def check_stats(repair: bool = typer.Option(False, "--repair", help="Overwrite drifted counters")):
+    """Recompute dashboard stats from scratch and report counter drift."""
+
+    async def check_all():
+        return [await server.check_stats(collection, repair=repair) for collection in server.STAT_BUCKETS]
+
+    typer.echo(json.dumps(run(check_all()), indent=2))
+
+
+@cli.command("extract-images")
+def extract_images(batch_size: int = typer.Option(100, help="Cars loaded per batch")):
+    """Move inline base64 car images into GridFS, leaving URLs on the car."""
+    moved = run(server.extract_inline_images(batch_size))
+    typer.echo(f"Moved inline images out of {moved} cars")
+
+
+@cli.command("refresh-pricing")
+def refresh_pricing(full: bool = typer.Option(False, "--full", help="Rebuild every group instead of just dirty ones")):
+    """Recompute the materialized pricing analytics."""
+    refreshed = run(server.refresh_pricing(full=full))
+    typer.echo(f"Refreshed {refreshed} pricing documents")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,23 +1,356 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Body, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from PIL import Image, ImageOps
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+import numpy as np
+import pandas as pd
+import jwt
 import os
+import gridfs
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter, ValidationError, field_validator, model_validator
+from typing import Any, Dict, List, Optional, Union
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 import base64
+import codecs
+import csv
+import binascii
+import json
+import re
+import unicodedata
+import asyncio
+import bisect
+import contextlib
+import itertools
+import math
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import hmac
+import io
+import multiprocessing
+import threading
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# ============ METRICS ============
+
+# Prometheus metrics for HTTP routes and Mongo commands, served at /metrics.
+# Routes are labelled by their path template (unknown paths share one
+# label) so cardinality stays bounded. METRICS=false skips the middleware,
+# the Mongo listeners and the endpoint entirely.
+METRICS_ENABLED = os.environ.get("METRICS", "true").lower() == "true"
+METRICS_REGISTRY = CollectorRegistry()
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status",
+    ["method", "route", "status"], registry=METRICS_REGISTRY,
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route"], registry=METRICS_REGISTRY,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served",
+    ["method"], registry=METRICS_REGISTRY,
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by command and collection",
+    ["command", "collection"], buckets=MONGO_BUCKETS, registry=METRICS_REGISTRY,
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Failed Mongo commands by command and collection",
+    ["command", "collection"], registry=METRICS_REGISTRY,
+)
+MONGO_CHECKOUT_WAIT = Histogram(
+    "mongo_pool_checkout_seconds", "Time spent waiting for a pooled Mongo connection",
+    ["address"], buckets=MONGO_BUCKETS, registry=METRICS_REGISTRY,
+)
+MONGO_CONNECTIONS_IN_USE = Gauge(
+    "mongo_pool_connections_in_use", "Mongo connections currently checked out",
+    ["address"], registry=METRICS_REGISTRY,
+)
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        name = event.command_name
+        target = event.command.get("collection" if name == "getMore" else name)
+        self.pending[(event.connection_id, event.request_id)] = (name, target if isinstance(target, str) else "")
+
+    def _finish(self, event) -> tuple:
+        labels = self.pending.pop((event.connection_id, event.request_id), (event.command_name, ""))
+        MONGO_COMMAND_LATENCY.labels(*labels).observe(event.duration_micros / 1e6)
+        return labels
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.labels(*self._finish(event)).inc()
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    # Motor runs each operation on an executor thread, so a checkout's start
+    # and finish happen on the same thread.
+    def __init__(self):
+        self.local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        address = "%s:%s" % event.address
+        MONGO_CHECKOUT_WAIT.labels(address).observe(time.perf_counter() - getattr(self.local, "started", time.perf_counter()))
+        MONGO_CONNECTIONS_IN_USE.labels(address).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_CONNECTIONS_IN_USE.labels("%s:%s" % event.address).dec()
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+class MetricsMiddleware:
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+        self._templates = None
+
+    def route_label(self, scope) -> str:
+        if self._templates is None:
+            self._templates = {route.endpoint: route.path for route in self.routes if hasattr(route, "endpoint")}
+            self._static = {path for path in self._templates.values() if "{" not in path}
+        # The router leaves the matched endpoint in scope; requests rejected
+        # before routing (e.g. rate limited) fall back to static paths
+        endpoint = scope.get("endpoint")
+        if endpoint in self._templates:
+            return self._templates[endpoint]
+        return scope["path"] if scope["path"] in self._static else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        in_flight = HTTP_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            route = self.route_label(scope)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+
+# ============ SLOW QUERIES ============
+
+# Every Mongo command is timed by a command listener. Commands slower than
+# SLOW_QUERY_MS land in a ring buffer with their normalized shape, and read
+# commands are explained (executionStats) once per shape every
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds to show the winning plan.
+# SLOW_QUERY_MS=0 turns the recorder off.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_BUFFER = int(os.environ.get("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+SHAPE_FIELDS = ("filter", "query", "sort", "pipeline", "key", "projection")
+UNEXPLAINED_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+def query_shape(value):
+    """Replace literal values with "?" so queries differing only in values match.
+
+    Sort and projection specs are kept as-is since they affect the plan.
+    """
+    if isinstance(value, dict):
+        return {key: item if key in ("$sort", "$project") else query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def plan_summary(explain: dict) -> dict:
+    """Stages, index names and examined/returned counts from explain output."""
+    planner, stats = None, None
+    pending = [explain]
+    while pending and not (planner and stats):
+        node = pending.pop()
+        if isinstance(node, dict):
+            planner = planner or node.get("queryPlanner")
+            stats = stats or node.get("executionStats")
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    
+    stages, indexes = [], []
+    plan = (planner or {}).get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)
+    while plan:
+        stages.append(plan.get("stage"))
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    stats = stats or {}
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "collscan": "COLLSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}
+        self.samples = deque(maxlen=SLOW_QUERY_BUFFER)
+        self.explained = {}
+        self.loop = None
+
+    def started(self, event):
+        if event.command_name != "explain":
+            self.pending[(event.connection_id, event.request_id)] = (event.command, event.database_name)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        started = self.pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if started is None or duration_ms < SLOW_QUERY_MS:
+            return
+        command, database = started
+        name = event.command_name
+        target = command.get("collection" if name == "getMore" else name)
+        shape = {
+            key: command[key] if key in ("sort", "projection") else query_shape(command[key])
+            for key in SHAPE_FIELDS if key in command
+        }
+        sample = {
+            "at": datetime.now(timezone.utc),
+            "command": name,
+            "collection": target if isinstance(target, str) else None,
+            "duration_ms": round(duration_ms, 2),
+            "failed": failed,
+            "shape": shape,
+            "plan": None,
+        }
+        self.samples.append(sample)
+        
+        key = json.dumps([name, sample["collection"], shape], sort_keys=True, default=str)
+        now = time.monotonic()
+        if name in EXPLAINABLE_COMMANDS and self.loop is not None and now - self.explained.get(key, -math.inf) >= SLOW_QUERY_EXPLAIN_INTERVAL:
+            self.explained[key] = now
+            explain = {field: value for field, value in command.items() if field not in UNEXPLAINED_FIELDS and not field.startswith("$")}
+            # Listeners run on Motor's executor threads; the explain has to
+            # be issued from the event loop.
+            self.loop.call_soon_threadsafe(self._schedule_explain, sample, explain, database)
+
+    def _schedule_explain(self, sample: dict, command: dict, database: str):
+        task = asyncio.create_task(self._explain(sample, command, database))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _explain(self, sample: dict, command: dict, database: str):
+        try:
+            explain = await client[database].command({"explain": command, "verbosity": "executionStats"})
+            sample["plan"] = plan_summary(explain)
+        except Exception as exc:
+            sample["plan"] = {"error": str(exc)}
+
+    def report(self) -> dict:
+        samples = list(self.samples)
+        shapes = {}
+        for sample in samples:
+            key = json.dumps([sample["command"], sample["collection"], sample["shape"]], sort_keys=True, default=str)
+            group = shapes.setdefault(key, {
+                "command": sample["command"],
+                "collection": sample["collection"],
+                "shape": sample["shape"],
+                "count": 0,
+                "max_ms": 0.0,
+                "total_ms": 0.0,
+                "plan": None,
+            })
+            group["count"] += 1
+            group["max_ms"] = max(group["max_ms"], sample["duration_ms"])
+            group["total_ms"] += sample["duration_ms"]
+            group["plan"] = sample["plan"] or group["plan"]
+        by_shape = sorted(shapes.values(), key=lambda group: group["total_ms"], reverse=True)
+        for group in by_shape:
+            group["avg_ms"] = round(group.pop("total_ms") / group["count"], 2)
+        return {"threshold_ms": SLOW_QUERY_MS, "by_shape": by_shape, "samples": samples[::-1]}
+
+slow_queries = SlowQueryLog()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+listeners = [CommandMetrics(), PoolMetrics()] if METRICS_ENABLED else []
+if SLOW_QUERY_MS > 0:
+    listeners.append(slow_queries)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=listeners)
 db = client[os.environ['DB_NAME']]
+images_fs = AsyncIOMotorGridFSBucket(db, bucket_name="images")
+derivatives_fs = AsyncIOMotorGridFSBucket(db, bucket_name="image_derivatives")
 
 # Create the main app
 app = FastAPI()
@@ -25,8 +358,139 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# ============ INDEXES ============
+
+# Declarative index spec per collection. `ensure_indexes` reconciles the
+# database against it at startup; `python manage.py indexes` reports drift.
+INDEX_SPECS = {
+    "cars": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("stock_number", ASCENDING)], name="stock_number_unique", unique=True,
+            partialFilterExpression={"stock_number": {"$type": "string"}},
+        ),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("body_type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="body_type_created_at_id"),
+        IndexModel([("brand_key", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="brand_key_created_at_id"),
+        IndexModel([("status", ASCENDING), ("price", ASCENDING)], name="status_price"),
+        IndexModel([("is_featured", ASCENDING), ("status", ASCENDING)], name="is_featured_status"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "inquiries": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("car_id", ASCENDING)], name="car_id"),
+    ],
+    "contacts": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "token_denylist": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "car_tombstones": [
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+def _index_signature(index: dict) -> tuple:
+    return (list(index["key"].items()), bool(index.get("unique", False)), index.get("expireAfterSeconds"))
+
+async def index_report() -> dict:
+    report = {}
+    for collection, specs in INDEX_SPECS.items():
+        existing = {ix["name"]: ix async for ix in db[collection].list_indexes()}
+        entry = {"present": [], "missing": [], "mismatched": [], "extra": []}
+        for model in specs:
+            name = model.document["name"]
+            if name not in existing:
+                entry["missing"].append(name)
+            elif _index_signature(existing[name]) != _index_signature(model.document):
+                entry["mismatched"].append(name)
+            else:
+                entry["present"].append(name)
+        expected = {model.document["name"] for model in specs}
+        entry["extra"] = sorted(name for name in existing if name != "_id_" and name not in expected)
+        report[collection] = entry
+    return report
+
+async def ensure_indexes(drop_extra: bool = False) -> dict:
+    report = await index_report()
+    for collection, specs in INDEX_SPECS.items():
+        entry = report[collection]
+        for name in entry["mismatched"] + (entry["extra"] if drop_extra else []):
+            await db[collection].drop_index(name)
+        todo = set(entry["missing"] + entry["mismatched"])
+        models = [model for model in specs if model.document["name"] in todo]
+        if models:
+            await db[collection].create_indexes(models)
+            logger.info("Created indexes on %s: %s", collection, sorted(todo))
+    return await index_report()
+
+# ============ BRAND KEYS ============
+
+# Cars carry a normalized `brand_key` (ascii-folded, lowercased, single
+# spaced) so brand filters are an index seek instead of a regex scan.
+def brand_key(brand: str) -> str:
+    folded = unicodedata.normalize("NFKD", brand).encode("ascii", "ignore").decode()
+    return " ".join(folded.lower().split())
+
+async def backfill_brand_keys(batch_size: int = 1000) -> int:
+    updated = 0
+    ops = []
+    async for car in db.cars.find({}, {"_id": 1, "brand": 1, "brand_key": 1}):
+        key = brand_key(car.get("brand") or "")
+        if car.get("brand_key") == key:
+            continue
+        ops.append(UpdateOne({"_id": car["_id"]}, {"$set": {"brand_key": key}}))
+        if len(ops) >= batch_size:
+            updated += (await db.cars.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        updated += (await db.cars.bulk_write(ops, ordered=False)).modified_count
+    return updated
+
+# ============ TIMESTAMP MIGRATION ============
+
+TIMESTAMP_FIELDS = {
+    "cars": ["created_at", "updated_at"],
+    "inquiries": ["created_at"],
+    "contacts": ["created_at"],
+}
+
+async def migrate_timestamps(batch_size: int = 1000) -> dict:
+    # Converts legacy ISO-string timestamps to BSON dates in place. Only
+    # string-typed fields are selected, so an interrupted run simply resumes.
+    converted = {}
+    for collection, fields in TIMESTAMP_FIELDS.items():
+        converted[collection] = 0
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        projection = {field: 1 for field in fields}
+        while True:
+            docs = await db[collection].find(query, projection).sort("_id", 1).to_list(batch_size)
+            if not docs:
+                break
+            ops = []
+            for doc in docs:
+                update = {
+                    field: datetime.fromisoformat(doc[field])
+                    for field in fields if isinstance(doc.get(field), str)
+                }
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            await db[collection].bulk_write(ops, ordered=False)
+            converted[collection] += len(ops)
+    return converted
+
 # ============ MODELS ============
 
+# The unique stock_number index only covers string values, so a blank
+# stock number is stored as null rather than colliding with other blanks.
+def blank_to_none(value):
+    return None if isinstance(value, str) and not value.strip() else value
+
 class CarBase(BaseModel):
     brand: str
     model: str
@@ -43,6 +507,12 @@ class CarBase(BaseModel):
     images: List[str] = []  # Base64 or URLs
     is_featured: bool = False
     status: str = "available"  # available, sold, reserved
+    stock_number: Optional[str] = None  # DMS stock number, used to upsert imports
+
+    @field_validator("stock_number", mode="before")
+    @classmethod
+    def blank_stock_number(cls, value):
+        return blank_to_none(value)
 
 class CarCreate(CarBase):
     pass
@@ -63,13 +533,67 @@ class CarUpdate(BaseModel):
     images: Optional[List[str]] = None
     is_featured: Optional[bool] = None
     status: Optional[str] = None
+    stock_number: Optional[str] = None
+
+    @field_validator("stock_number", mode="before")
+    @classmethod
+    def blank_stock_number(cls, value):
+        return blank_to_none(value)
 
 class Car(CarBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 0  # bumped by every write; documents written before it existed count as 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class CarSummary(BaseModel):
+    """The slice of a car the inventory grid renders, with one thumbnail."""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    brand: str
+    model: str
+    year: int
+    price: float
+    mileage: int
+    fuel_type: str
+    transmission: str
+    body_type: str
+    is_featured: bool = False
+    status: str = "available"
+    thumbnail: Optional[str] = None
+    created_at: datetime
+
+    @model_validator(mode="before")
+    @classmethod
+    def pick_thumbnail(cls, data):
+        if isinstance(data, dict) and "thumbnail" not in data:
+            images = data.get("images") or []
+            thumbnail = images[0] if images else None
+            if thumbnail and thumbnail.startswith("/api/images/"):
+                thumbnail += "/card"
+            data = {**data, "thumbnail": thumbnail}
+        return data
+
+class CarBulkOperation(BaseModel):
+    id: str
+    update: CarUpdate
+
+class CarBulkUpdate(BaseModel):
+    operations: List[CarBulkOperation] = Field(max_length=5000)
+
+class CarPage(BaseModel):
+    items: List[Car]
+    next_cursor: Optional[str] = None
+
+class CarSummaryPage(BaseModel):
+    items: List[CarSummary]
+    next_cursor: Optional[str] = None
+
+class CarSearchPage(BaseModel):
+    items: List[Car]
+    total: int
+
 class InquiryBase(BaseModel):
     car_id: str
     name: str
@@ -84,6 +608,7 @@ class Inquiry(InquiryBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     status: str = "new"  # new, contacted, closed
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ContactMessage(BaseModel):
@@ -101,23 +626,1455 @@ class AdminLogin(BaseModel):
     username: str
     password: str
 
+# ============ SERIALIZATION ============
+
+# With FAST_RESPONSES=true the read endpoints validate Mongo documents once
+# with a prebuilt TypeAdapter and dump JSON in pydantic-core, instead of
+# FastAPI's validate -> jsonable python -> json.dumps round. The bytes are
+# identical (see bench_serialization.py).
+FAST_RESPONSES = os.environ.get("FAST_RESPONSES", "false").lower() == "true"
+
+_car = TypeAdapter(Car)
+_car_list = TypeAdapter(List[Car])
+_car_page = TypeAdapter(CarPage)
+_inquiry_list = TypeAdapter(List[Inquiry])
+_contact_list = TypeAdapter(List[ContactMessageDB])
+_summary_list = TypeAdapter(List[CarSummary])
+_summary_page = TypeAdapter(CarSummaryPage)
+_search_page = TypeAdapter(CarSearchPage)
+_projected_list = TypeAdapter(List[Dict[str, Any]])
+_projected_page = TypeAdapter(Dict[str, Any])
+
+def fast_json(adapter: TypeAdapter, value, headers: Optional[dict] = None) -> Response:
+    body = adapter.dump_json(adapter.validate_python(value))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ============ CACHE ============
+
+_MISSING = object()
+
+class TTLCache:
+    """Size-bounded LRU with per-entry TTL for rarely changing read endpoints.
+
+    Concurrent misses on the same key share a single in-flight load, and
+    `invalidate` bumps a generation so loads racing a write are not stored.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: str, loader):
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+        
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # nobody may be waiting; mark it retrieved
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+            if generation == self._generation:
+                self._store(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, *prefixes: str):
+        self._generation += 1
+        self.invalidations += 1
+        for key in [key for key in self._entries if key.startswith(prefixes)]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+cache = TTLCache(
+    ttl=float(os.environ.get("CACHE_TTL", "30")),
+    max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "256")),
+)
+
+# ============ STATS ============
+
+# "aggregate" computes dashboard stats with one aggregation per request;
+# "counters" reads a small per-collection document in `db.stats` that the
+# write paths keep up to date with $inc.
+STATS_MODE = os.environ.get("STATS_MODE", "aggregate")
+STATS_CHECK_INTERVAL = int(os.environ.get("STATS_CHECK_INTERVAL", "0"))
+
+STAT_BUCKETS = {
+    "cars": {"status": ["available", "sold", "reserved"], "flag": "featured"},
+    "inquiries": {"status": ["new", "contacted", "closed"], "flag": None},
+}
+
+def _count_if(condition) -> dict:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+async def compute_stats(collection: str) -> dict:
+    buckets = STAT_BUCKETS[collection]
+    group = {"_id": None, "total": {"$sum": 1}}
+    for status in buckets["status"]:
+        group[status] = _count_if({"$eq": ["$status", status]})
+    if buckets["flag"]:
+        group[buckets["flag"]] = _count_if({"$eq": ["$is_featured", True]})
+    result = await db[collection].aggregate([{"$group": group}]).to_list(1)
+    stats = result[0] if result else {}
+    return {key: stats.get(key, 0) for key in group if key != "_id"}
+
+def stats_delta(collection: str, doc: Optional[dict], sign: int) -> dict:
+    if not doc:
+        return {}
+    buckets = STAT_BUCKETS[collection]
+    delta = {"total": sign}
+    if doc.get("status") in buckets["status"]:
+        delta[doc["status"]] = sign
+    if buckets["flag"] and doc.get("is_featured"):
+        delta[buckets["flag"]] = sign
+    return delta
+
+async def bump_stats(collection: str, before: Optional[dict] = None, after: Optional[dict] = None):
+    await bump_stats_many(collection, [(before, after)])
+
+async def bump_stats_many(collection: str, changes: list):
+    if STATS_MODE != "counters":
+        return
+    delta = {}
+    for before, after in changes:
+        for doc, sign in ((after, 1), (before, -1)):
+            for key, value in stats_delta(collection, doc, sign).items():
+                delta[key] = delta.get(key, 0) + value
+    delta = {key: value for key, value in delta.items() if value}
+    if delta:
+        await db.stats.update_one({"_id": collection}, {"$inc": delta}, upsert=True)
+
+async def read_stats(collection: str) -> dict:
+    if STATS_MODE != "counters":
+        return await compute_stats(collection)
+    stored = await db.stats.find_one({"_id": collection})
+    if stored is None:
+        return (await check_stats(collection, repair=True))["actual"]
+    keys = ["total"] + STAT_BUCKETS[collection]["status"] + [STAT_BUCKETS[collection]["flag"]]
+    return {key: stored.get(key, 0) for key in keys if key}
+
+async def check_stats(collection: str, repair: bool = False) -> dict:
+    actual = await compute_stats(collection)
+    stored = await db.stats.find_one({"_id": collection}) or {}
+    drift = {
+        key: stored.get(key, 0) - value
+        for key, value in actual.items() if stored.get(key, 0) != value
+    }
+    repaired = repair and bool(drift or not stored)
+    if repaired:
+        await db.stats.update_one({"_id": collection}, {"$set": actual}, upsert=True)
+    return {"collection": collection, "actual": actual, "drift": drift, "repaired": repaired}
+
+async def stats_check_loop():
+    while True:
+        await asyncio.sleep(STATS_CHECK_INTERVAL)
+        for collection in STAT_BUCKETS:
+            try:
+                result = await check_stats(collection, repair=True)
+                if result["drift"]:
+                    logger.warning("Stats drift on %s: %s", collection, result["drift"])
+            except Exception:
+                logger.exception("Stats consistency check failed")
+
+# ============ WRITE-BEHIND ============
+
+# With WRITE_BEHIND=true, public inquiry/contact submissions are acknowledged
+# once queued and flushed with insert_many every WRITE_BATCH_SIZE documents
+# or WRITE_FLUSH_INTERVAL seconds. A full queue answers 429. Queued
+# documents are flushed on shutdown but not across a crash, so this trades
+# durability for throughput during campaign spikes.
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "false").lower() == "true"
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", "10000"))
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", "0.25"))
+WRITE_RETRIES = 3
+
+class WriteBehindQueue:
+    def __init__(self, collection: str, on_flush=None):
+        self.collection = collection
+        self.on_flush = on_flush
+        self.queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._batch = []
+        self._task = None
+        self.flushed = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, doc: dict):
+        try:
+            self.queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429, detail="Too many submissions, please retry", headers={"Retry-After": "1"}
+            )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = [await self.queue.get()]
+            deadline = loop.time() + WRITE_FLUSH_INTERVAL
+            while len(self._batch) < WRITE_BATCH_SIZE:
+                try:
+                    self._batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(self._batch)
+            self._batch = []
+
+    async def _flush(self, batch: list):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                await db[self.collection].insert_many(batch, ordered=False)
+                break
+            except BulkWriteError as exc:
+                # Duplicates from a flush interrupted by shutdown are expected
+                failed = [e for e in exc.details.get("writeErrors", []) if e.get("code") != 11000]
+                if failed:
+                    logger.error("Dropped %d %s writes: %s", len(failed), self.collection, failed[0].get("errmsg"))
+                    self.dropped += len(failed)
+                break
+            except Exception:
+                if attempt == WRITE_RETRIES - 1:
+                    logger.exception("Dropped %d queued %s writes", len(batch), self.collection)
+                    self.dropped += len(batch)
+                    return
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        self.flushed += len(batch)
+        if self.on_flush:
+            await self.on_flush(batch)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        pending = self._batch
+        self._batch = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for start in range(0, len(pending), WRITE_BATCH_SIZE):
+            await self._flush(pending[start:start + WRITE_BATCH_SIZE])
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "flushed": self.flushed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
+
+async def inquiries_flushed(batch: list):
+    await bump_stats_many("inquiries", [(None, doc) for doc in batch])
+    cache.invalidate("inquiries:")
+
+write_queues = {
+    "inquiries": WriteBehindQueue("inquiries", on_flush=inquiries_flushed),
+    "contacts": WriteBehindQueue("contacts"),
+}
+
+# Inquiry car checks get their own cache so a long tail of car ids cannot
+# evict the listing entries in `cache`. Only hits are remembered: a failed
+# lookup raises, which TTLCache never stores.
+known_cars = TTLCache(
+    ttl=float(os.environ.get("CACHE_TTL", "30")),
+    max_entries=int(os.environ.get("KNOWN_CARS_MAX_ENTRIES", "4096")),
+)
+
+async def car_exists(car_id: str) -> bool:
+    async def lookup():
+        if await db.cars.find_one({"id": car_id}, {"_id": 1}) is None:
+            raise LookupError(car_id)
+        return True
+    
+    try:
+        return await known_cars.get_or_load(car_id, lookup)
+    except LookupError:
+        return False
+
+# ============ RATE LIMITING ============
+
+# Public write routes are throttled per client IP and per route as a whole.
+# A limit of (burst, seconds) allows `burst` requests at once, refilling at
+# burst/seconds per second. The check runs as ASGI middleware, so rejected
+# requests never reach routing, body parsing or validation.
+#
+# Behind a reverse proxy (as in the hosted deployment) every request arrives
+# from the proxy's address, so all visitors would share one per-IP bucket.
+# Set RATE_LIMIT_TRUST_FORWARDED=true there to key on the address the proxy
+# appends to X-Forwarded-For. Leave it off when clients can reach the API
+# directly, since they could then spoof the header.
+RATE_LIMITING = os.environ.get("RATE_LIMITING", "true").lower() == "true"
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+RATE_LIMIT_SWEEP_INTERVAL = 60.0
+RATE_LIMITS = {
+    "POST /api/inquiries": {"ip": (5, 60), "route": (100, 1)},
+    "POST /api/contact": {"ip": (5, 60), "route": (100, 1)},
+    "POST /api/admin/login": {"ip": (10, 300), "route": None},
+    "POST /api/admin/refresh": {"ip": (30, 300), "route": None},
+    # e.g. RATE_LIMITS='{"POST /api/contact": {"ip": [2, 60], "route": null}}'
+    **json.loads(os.environ.get("RATE_LIMITS", "{}")),
+}
+
+class TokenBucketLimiter:
+    """Token buckets stored as one float per key (GCRA form).
+
+    A key's value is the time its bucket would be full again; a request
+    spends one token by pushing that time out by seconds/burst. Keys whose
+    bucket has refilled are swept, so idle clients cost nothing.
+    """
+
+    def __init__(self):
+        self.full_at = {}
+        self.next_sweep = 0.0
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, key, burst: int, seconds: float, now: float) -> float:
+        """Spend a token for `key`; return 0 if allowed, else seconds to wait."""
+        interval = seconds / burst
+        full_at = max(self.full_at.get(key, now), now) + interval
+        if full_at - now > seconds:
+            return full_at - now - seconds
+        self.full_at[key] = full_at
+        return 0.0
+
+    def check(self, route: str, client: str, limits: dict) -> float:
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.full_at = {key: full_at for key, full_at in self.full_at.items() if full_at > now}
+            self.next_sweep = now + RATE_LIMIT_SWEEP_INTERVAL
+        
+        waits = []
+        if limits.get("ip"):
+            waits.append(self.hit((route, client), *limits["ip"], now))
+        # Only spend from the shared route bucket once the client's own allows it
+        if limits.get("route") and not any(waits):
+            waits.append(self.hit(route, *limits["route"], now))
+        wait = max(waits, default=0.0)
+        if wait:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"buckets": len(self.full_at), "allowed": self.allowed, "rejected": self.rejected}
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter, limits: dict):
+        self.app = app
+        self.limiter = limiter
+        self.limits = limits
+
+    def client_address(self, scope) -> str:
+        if RATE_LIMIT_TRUST_FORWARDED:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    # The right-most entry is the one our own proxy appended
+                    return value.decode("latin-1").rsplit(",", 1)[-1].strip()
+        return scope["client"][0] if scope.get("client") else ""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            route = f"{scope['method']} {scope['path']}"
+            limits = self.limits.get(route)
+            if limits:
+                wait = self.limiter.check(route, self.client_address(scope), limits)
+                if wait:
+                    response = JSONResponse(
+                        {"detail": "Too many requests"},
+                        status_code=429,
+                        headers={"Retry-After": str(math.ceil(wait))},
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+rate_limiter = TokenBucketLimiter()
+
+# ============ ADMIN SESSIONS ============
+
+# Admin login issues a short-lived access token and a longer-lived refresh
+# token, both HS256 JWTs. Verified access tokens are cached in memory, so
+# `require_admin` is a dict lookup on repeat calls. Revoked token ids live
+# in `db.token_denylist` (expired entries are TTL-deleted) and each worker
+# reloads that list at most every ADMIN_DENYLIST_SYNC seconds.
+# The secret must be shared by every worker, so startup refuses to run
+# without one rather than signing with a per-process random key.
+ADMIN_TOKEN_SECRET = os.environ.get("ADMIN_TOKEN_SECRET", "")
+ADMIN_TOKEN_TTL = int(os.environ.get("ADMIN_TOKEN_TTL", "900"))
+ADMIN_REFRESH_TTL = int(os.environ.get("ADMIN_REFRESH_TTL", str(7 * 24 * 3600)))
+ADMIN_DENYLIST_SYNC = float(os.environ.get("ADMIN_DENYLIST_SYNC", "5"))
+ADMIN_TOKEN_CACHE_SIZE = 1024
+
+def issue_token(subject: str, kind: str, ttl: int) -> str:
+    now = int(time.time())
+    claims = {"sub": subject, "typ": kind, "jti": uuid.uuid4().hex, "iat": now, "exp": now + ttl}
+    return jwt.encode(claims, ADMIN_TOKEN_SECRET, algorithm="HS256")
+
+def issue_session(subject: str) -> dict:
+    return {
+        "access_token": issue_token(subject, "access", ADMIN_TOKEN_TTL),
+        "refresh_token": issue_token(subject, "refresh", ADMIN_REFRESH_TTL),
+        "token_type": "bearer",
+        "expires_in": ADMIN_TOKEN_TTL,
+    }
+
+class TokenVerifier:
+    def __init__(self):
+        self.verified = OrderedDict()
+        self.denied = set()
+        self.next_sync = 0.0
+
+    async def sync_denylist(self):
+        if time.monotonic() < self.next_sync:
+            return
+        self.next_sync = time.monotonic() + ADMIN_DENYLIST_SYNC
+        self.denied = {doc["_id"] async for doc in db.token_denylist.find({}, {"_id": 1})}
+
+    def unauthorized(self, detail: str) -> HTTPException:
+        return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+    async def verify(self, token: str, kind: str = "access") -> dict:
+        await self.sync_denylist()
+        claims = self.verified.get(token) if kind == "access" else None
+        if claims is None:
+            try:
+                claims = jwt.decode(token, ADMIN_TOKEN_SECRET, algorithms=["HS256"], options={"require": ["exp", "jti", "sub"]})
+            except jwt.PyJWTError:
+                raise self.unauthorized("Invalid or expired token")
+            if claims.get("typ") != kind:
+                raise self.unauthorized("Invalid or expired token")
+            if kind == "access":
+                self.verified[token] = claims
+                if len(self.verified) > ADMIN_TOKEN_CACHE_SIZE:
+                    self.verified.popitem(last=False)
+        elif claims["exp"] <= time.time():
+            del self.verified[token]
+            raise self.unauthorized("Invalid or expired token")
+        if claims["jti"] in self.denied:
+            raise self.unauthorized("Token has been revoked")
+        return claims
+
+    async def revoke(self, *claims: dict):
+        # The insert is the replay check: of two requests presenting the same
+        # token, on any workers, exactly one gets to revoke it.
+        for claim in claims:
+            expires_at = datetime.fromtimestamp(claim["exp"], timezone.utc)
+            self.denied.add(claim["jti"])
+            try:
+                await db.token_denylist.insert_one({"_id": claim["jti"], "expires_at": expires_at})
+            except DuplicateKeyError:
+                raise self.unauthorized("Token has been revoked")
+
+token_verifier = TokenVerifier()
+
+def bearer_token(authorization: Optional[str]) -> str:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise token_verifier.unauthorized("Not authenticated")
+    return token.strip()
+
+async def require_admin(authorization: Optional[str] = Header(None)) -> dict:
+    return await token_verifier.verify(bearer_token(authorization))
+
+# ============ HTTP CACHING ============
+
+# Car details get a strong ETag from id + updated_at. Listings get a weak
+# ETag from the catalog version, a counter in db.meta bumped by every car
+# write, so all workers agree on when a listing may have changed.
+CDN_MAX_AGE = int(os.environ.get("CDN_MAX_AGE", "0"))
+
+def revalidate_cache_control() -> str:
+    if CDN_MAX_AGE:
+        return f"public, max-age=0, s-maxage={CDN_MAX_AGE}, must-revalidate"
+    return "public, no-cache"
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    # If-Modified-Since is ignored when the client also sent If-None-Match
+    header = request.headers.get("if-modified-since")
+    if not header or "if-none-match" in request.headers:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+def resource_etag(resource_id: str, version: int) -> str:
+    return f'"{resource_id}-{version}"'
+
+def if_match_filter(resource_id: str, header: Optional[str]) -> dict:
+    # Turns If-Match ETags into a version filter for find_one_and_update, so
+    # the precondition check and the write are a single atomic round trip.
+    if header is None:
+        return {}
+    tags = [tag.strip() for tag in header.split(",")]
+    if "*" in tags:
+        return {}
+    prefix = f'"{resource_id}-'
+    versions = [
+        int(tag[len(prefix):-1]) for tag in tags
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit()
+    ]
+    if not versions:
+        raise HTTPException(status_code=412, detail="Precondition failed")
+    return {"version": {"$in": versions + [None] if 0 in versions else versions}}
+
+async def missing_or_stale(collection: str, resource_id: str, detail: str, if_match: Optional[str]):
+    if if_match is not None and await db[collection].find_one({"id": resource_id}, {"_id": 1}):
+        raise HTTPException(status_code=412, detail="Modified by someone else; reload and retry")
+    raise HTTPException(status_code=404, detail=detail)
+
+def car_cache_headers(car: dict) -> dict:
+    updated_at = car["updated_at"]
+    return {
+        "ETag": resource_etag(car["id"], car.get("version", 0)),
+        "Last-Modified": format_datetime(updated_at.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": revalidate_cache_control(),
+    }
+
+async def catalog_version() -> int:
+    doc = await db.meta.find_one({"_id": "catalog"}, {"version": 1})
+    return doc["version"] if doc else 0
+
+async def touch_catalog():
+    cache.invalidate("cars:")
+    await db.meta.update_one({"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True)
+
+def listing_cache_headers(version: int, request: Request) -> dict:
+    params = sorted(request.query_params.multi_items())
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+    return {"ETag": f'W/"{version}-{digest}"', "Cache-Control": revalidate_cache_control()}
+
+# ============ IMAGES ============
+
+# Car documents only hold image URLs. Uploaded and legacy inline base64
+# images live in the `images` GridFS bucket and are served by /api/images.
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_CHUNK_SIZE = 255 * 1024
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+# Stored and served content types always come from these signatures, never
+# from the client, so nothing scriptable (e.g. SVG) is served from our origin.
+IMAGE_CONTENT_TYPES = {content_type for _, content_type in IMAGE_SIGNATURES}
+
+# Resized WebP derivatives are keyed by the sha256 of the original, so the
+# same picture uploaded twice (or attached to two cars) is rendered once.
+IMAGE_VARIANTS = {"card": 480, "gallery": 1280, "hero": 1920}
+IMAGE_WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_image_pool = None
+_derivative_jobs = {}
+_background_tasks = set()
+
+def image_url(image_id: str) -> str:
+    return f"/api/images/{image_id}"
+
+def render_derivative(data: bytes, width: int, quality: int) -> bytes:
+    # Runs in a worker process, so it must not touch the event loop or db
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+        image.thumbnail((width, width * 4))
+        out = io.BytesIO()
+        image.save(out, format="WEBP", quality=quality)
+        return out.getvalue()
+
+def image_pool() -> ProcessPoolExecutor:
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _image_pool
+
+async def _render_and_store(derivative_id: str, source: bytes, width: int) -> bytes:
+    global _image_pool
+    loop = asyncio.get_running_loop()
+    pool = image_pool()
+    try:
+        data = await loop.run_in_executor(pool, render_derivative, source, width, IMAGE_WEBP_QUALITY)
+    except BrokenProcessPool:
+        if _image_pool is pool:
+            _image_pool = None  # a worker died; start a fresh pool next time
+        raise
+    try:
+        await derivatives_fs.upload_from_stream_with_id(
+            derivative_id, derivative_id + ".webp", data, metadata={"content_type": "image/webp"}
+        )
+    except DuplicateKeyError:
+        pass  # another worker stored the same derivative first
+    return data
+
+async def build_derivative(digest: str, variant: str, source: bytes) -> bytes:
+    derivative_id = f"{digest}-{variant}"
+    job = _derivative_jobs.get(derivative_id)
+    if job is None:
+        job = asyncio.ensure_future(_render_and_store(derivative_id, source, IMAGE_VARIANTS[variant]))
+        _derivative_jobs[derivative_id] = job
+        job.add_done_callback(lambda _: _derivative_jobs.pop(derivative_id, None))
+    return await asyncio.shield(job)
+
+def schedule_derivatives(digest: str, source: bytes):
+    async def prewarm():
+        for variant in IMAGE_VARIANTS:
+            try:
+                await build_derivative(digest, variant, source)
+            except Exception:
+                logger.warning("Could not render %s derivative of %s", variant, digest, exc_info=True)
+                return
+    
+    task = asyncio.create_task(prewarm())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def sniff_content_type(data: bytes) -> Optional[str]:
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            # RIFF is also the container for WAV and AVI
+            if content_type == "image/webp" and data[8:12] != b"WEBP":
+                return None
+            return content_type
+    return None
+
+IMAGE_URL_PREFIXES = ("http://", "https://", "/")
+
+def decode_inline_image(value: str) -> Optional[tuple]:
+    if value.startswith(IMAGE_URL_PREFIXES):
+        return None
+    payload = value
+    if value.startswith("data:"):
+        payload = value.partition(",")[2]  # the declared type is ignored
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    content_type = sniff_content_type(data)
+    if not content_type:
+        return None
+    return data, content_type
+
+async def store_image(data: bytes, content_type: str, filename: str = "image") -> str:
+    image_id = uuid.uuid4().hex
+    digest = hashlib.sha256(data).hexdigest()
+    await images_fs.upload_from_stream_with_id(
+        image_id, filename, data, metadata={"content_type": content_type, "sha256": digest}
+    )
+    schedule_derivatives(digest, data)
+    return image_id
+
+async def externalize_images(images: List[str]) -> List[str]:
+    result = []
+    for value in images:
+        inline = decode_inline_image(value)
+        if inline:
+            value = image_url(await store_image(*inline))
+        result.append(value)
+    return result
+
+async def extract_inline_images(batch_size: int = 100) -> int:
+    # Only cars that still have a non-URL image are selected, so reruns resume.
+    query = {"images": {"$elemMatch": {"$not": {"$regex": "^(https?://|/)"}}}}
+    moved = 0
+    skip_ids = []
+    while True:
+        batch_query = {**query, "id": {"$nin": skip_ids}} if skip_ids else query
+        cars = await db.cars.find(batch_query, {"_id": 0, "id": 1, "images": 1}).to_list(batch_size)
+        if not cars:
+            break
+        for car in cars:
+            images = await externalize_images(car["images"])
+            if images == car["images"]:
+                # Not decodable as an image; leave it and don't select it again
+                skip_ids.append(car["id"])
+                continue
+            await db.cars.update_one(
+                {"id": car["id"]},
+                {"$set": {"images": images, "updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}},
+            )
+            moved += 1
+    return moved
+
+# ============ SEARCH ============
+
+# Full-text search runs against an in-process inverted index rather than
+# Mongo; see CATALOG INDEXES for how it is kept in step with the cars
+# collection.
+SEARCH_FIELD_WEIGHTS = {
+    "brand": 3.0,
+    "model": 3.0,
+    "engine": 2.0,
+    "features": 1.5,
+    "color": 1.5,
+    "body_type": 1.0,
+    "fuel_type": 1.0,
+    "transmission": 1.0,
+    "description": 1.0,
+}
+SEARCH_CATEGORICAL_FIELDS = ("brand_key", "body_type", "fuel_type", "transmission", "status", "is_featured")
+SEARCH_NUMERIC_FIELDS = ("price", "year", "mileage")
+SEARCH_FILTER_FIELDS = SEARCH_CATEGORICAL_FIELDS + SEARCH_NUMERIC_FIELDS
+SEARCH_PROJECTION = {
+    "_id": 0, "id": 1,
+    **{name: 1 for name in SEARCH_FIELD_WEIGHTS},
+    **{name: 1 for name in SEARCH_FILTER_FIELDS},
+}
+SEARCH_PREFIX_EXPANSIONS = 30
+SEARCH_PREFIX_WEIGHT = 0.8
+SEARCH_FUZZY_MIN_LENGTH = 4
+SEARCH_FUZZY_WEIGHT = 0.6
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_TOKEN = re.compile(r"[a-z0-9]+")
+
+def search_terms(text: str) -> List[str]:
+    folded = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return SEARCH_TOKEN.findall(folded.lower())
+
+def single_deletes(term: str) -> set:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+def within_one_edit(a: str, b: str) -> bool:
+    # One substitution, insertion, deletion or adjacent transposition
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return a == b
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:])
+
+class SearchIndex:
+    """Inverted index scored with BM25 over weighted field term frequencies.
+
+    Every add gets a fresh slot; postings are append-only arrays of
+    (slot, weighted tf) per term and dead slots are masked out at query time
+    until enough of them pile up to compact. Filter fields are kept as
+    columns so car_filters queries are evaluated as array masks.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.ids = []
+        self.doc_terms = []
+        self.postings = {}
+        self.df = {}
+        self.vocabulary = []
+        self.deletes = {}
+        self.codes = {name: {} for name in SEARCH_CATEGORICAL_FIELDS}
+        self.capacity = 0
+        self.alive = np.zeros(0, dtype=bool)
+        self.lengths = np.zeros(0)
+        self.columns = {}
+        self._grow(1024)
+        self.total_length = 0.0
+
+    def _grow(self, capacity: int):
+        def resized(column, fill):
+            grown = np.full(capacity, fill, dtype=column.dtype)
+            grown[:len(column)] = column
+            return grown
+        
+        self.alive = resized(self.alive, False)
+        self.lengths = resized(self.lengths, 0.0)
+        for name in SEARCH_CATEGORICAL_FIELDS:
+            self.columns[name] = resized(self.columns.get(name, np.zeros(0, dtype=np.int32)), -1)
+        for name in SEARCH_NUMERIC_FIELDS:
+            self.columns[name] = resized(self.columns.get(name, np.zeros(0)), np.nan)
+        self.capacity = capacity
+
+    def add(self, car: dict):
+        car_id = car["id"]
+        self.remove(car_id)
+        weights = {}
+        for name, weight in SEARCH_FIELD_WEIGHTS.items():
+            value = car.get(name)
+            if not value:
+                continue
+            text = " ".join(value) if isinstance(value, list) else str(value)
+            for term in search_terms(text):
+                weights[term] = weights.get(term, 0.0) + weight
+        
+        slot = len(self.ids)
+        if slot == self.capacity:
+            self._grow(self.capacity * 2)
+        self.ids.append(car_id)
+        self.doc_terms.append(tuple(weights))
+        self.slots[car_id] = slot
+        self.alive[slot] = True
+        self.lengths[slot] = length = sum(weights.values())
+        self.total_length += length
+        for name in SEARCH_CATEGORICAL_FIELDS:
+            value = car.get(name)
+            if value is not None:
+                codes = self.codes[name]
+                self.columns[name][slot] = codes.setdefault(value, len(codes))
+        for name in SEARCH_NUMERIC_FIELDS:
+            value = car.get(name)
+            if value is not None:
+                self.columns[name][slot] = value
+        
+        for term, weight in weights.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("i"), array("f"))
+                self.df[term] = 0
+                self._add_term(term)
+            postings[0].append(slot)
+            postings[1].append(weight)
+            self.df[term] += 1
+
+    def remove(self, car_id: str):
+        slot = self.slots.pop(car_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = False
+        self.total_length -= self.lengths[slot]
+        for term in self.doc_terms[slot]:
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+                del self.postings[term]
+                self._remove_term(term)
+        self.doc_terms[slot] = ()
+        if len(self.ids) - len(self.slots) > max(1024, len(self.slots)):
+            self._compact()
+
+    def _compact(self):
+        alive = self.alive[:len(self.ids)]
+        remap = np.cumsum(alive, dtype=np.int32) - 1
+        for term, (slots, tfs) in self.postings.items():
+            slot_array = np.frombuffer(slots, dtype=np.int32)
+            keep = alive[slot_array]
+            self.postings[term] = (
+                array("i", remap[slot_array[keep]].tobytes()),
+                array("f", np.frombuffer(tfs, dtype=np.float32)[keep].tobytes()),
+            )
+        live = np.flatnonzero(alive)
+        self.ids = [self.ids[slot] for slot in live]
+        self.doc_terms = [self.doc_terms[slot] for slot in live]
+        self.slots = {car_id: slot for slot, car_id in enumerate(self.ids)}
+        count = len(self.ids)
+        self.alive[:count] = True
+        self.alive[count:] = False
+        self.lengths[:count] = self.lengths[live]
+        for name, column in self.columns.items():
+            column[:count] = column[live]
+
+    def _add_term(self, term: str):
+        bisect.insort(self.vocabulary, term)
+        if len(term) >= SEARCH_FUZZY_MIN_LENGTH:
+            for variant in single_deletes(term):
+                self.deletes.setdefault(variant, set()).add(term)
+
+    def _remove_term(self, term: str):
+        del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        if len(term) >= SEARCH_FUZZY_MIN_LENGTH:
+            for variant in single_deletes(term):
+                variants = self.deletes[variant]
+                variants.discard(term)
+                if not variants:
+                    del self.deletes[variant]
+
+    def expand(self, token: str) -> Dict[str, float]:
+        """Index terms a query token matches, with the weight of each match."""
+        expansions = {}
+        if token in self.df:
+            expansions[token] = 1.0
+        start = bisect.bisect_left(self.vocabulary, token)
+        prefixed = []
+        for term in itertools.islice(self.vocabulary, start, None):
+            if not term.startswith(token):
+                break
+            if term != token:
+                prefixed.append(term)
+        prefixed.sort(key=self.df.get, reverse=True)
+        for term in prefixed[:SEARCH_PREFIX_EXPANSIONS]:
+            expansions[term] = SEARCH_PREFIX_WEIGHT
+        if not expansions and len(token) >= SEARCH_FUZZY_MIN_LENGTH:
+            candidates = set(self.deletes.get(token, ()))
+            for variant in single_deletes(token):
+                candidates |= self.deletes.get(variant, set())
+                if variant in self.df:
+                    candidates.add(variant)
+            for term in candidates:
+                if within_one_edit(token, term):
+                    expansions[term] = SEARCH_FUZZY_WEIGHT
+        return expansions
+
+    def filter_mask(self, query: dict, size: int):
+        """Evaluate the subset of Mongo syntax that car_filters produces."""
+        mask = self.alive[:size].copy()
+        for name, condition in query.items():
+            column = self.columns[name][:size]
+            if name in self.codes:
+                codes = self.codes[name]
+                if isinstance(condition, dict):
+                    pattern = re.compile(condition["$regex"])
+                    wanted = [code for value, code in codes.items() if pattern.match(value)]
+                    mask &= np.isin(column, wanted)
+                else:
+                    mask &= column == codes.get(condition, -2)
+                continue
+            if "$gte" in condition:
+                mask &= column >= condition["$gte"]
+            if "$lte" in condition:
+                mask &= column <= condition["$lte"]
+        return mask
+
+    def search(self, text: str, query: dict, limit: int) -> tuple:
+        """Rank cars matching every token of `text` and the car_filters query.
+
+        Returns (total matches, ids of the best `limit` matches in order).
+        """
+        tokens = list(dict.fromkeys(search_terms(text)))
+        if not tokens or not self.slots:
+            return 0, []
+        size = len(self.ids)
+        count = len(self.slots)
+        lengths = self.lengths[:size]
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self.total_length / count))
+        matched = self.filter_mask(query, size)
+        scores = np.zeros(size)
+        for token in tokens:
+            token_scores = np.zeros(size)
+            for term, weight in self.expand(token).items():
+                slots, tfs = self.postings[term]
+                slots = np.frombuffer(slots, dtype=np.int32)
+                tfs = np.frombuffer(tfs, dtype=np.float32)
+                df = self.df[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                term_scores = weight * idf * (BM25_K1 + 1) * tfs / (tfs + norms[slots])
+                token_scores[slots] = np.maximum(token_scores[slots], term_scores)
+            matched &= token_scores > 0
+            scores += token_scores
+        
+        candidates = np.flatnonzero(matched)
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return int(matched.sum()), [self.ids[slot] for slot in order]
+
+
+# ============ SIMILAR CARS ============
+
+# "You may also like" scores every available car against one car in a few
+# array operations: distance over standardized log price, year and log
+# mileage, matches on body/fuel/transmission/brand (the dot product of their
+# one-hot blocks), and cosine overlap of feature tags hashed into 64 bits.
+SIMILAR_WEIGHTS = {
+    "numeric": 0.4,
+    "body_type": 0.15,
+    "fuel_type": 0.1,
+    "transmission": 0.05,
+    "brand_key": 0.15,
+    "features": 0.15,
+}
+SIMILAR_CATEGORICAL_FIELDS = ("body_type", "fuel_type", "transmission", "brand_key")
+SIMILAR_SUMMARY_FIELDS = tuple(name for name in CarSummary.model_fields if name != "thumbnail")
+SIMILAR_PROJECTION = {
+    "_id": 0,
+    **{name: 1 for name in SIMILAR_SUMMARY_FIELDS + SIMILAR_CATEGORICAL_FIELDS},
+    "features": 1,
+    "images": {"$slice": 1},
+}
+SIMILAR_NUMERIC_FIELDS = ("price", "year", "mileage")
+SIMILAR_LOG_FIELDS = ("price", "mileage")
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+INVERSE_SQRT = np.array([0.0] + [count ** -0.5 for count in range(1, 65)], dtype=np.float32)
+
+def feature_bits(features: List[str]) -> int:
+    bits = 0
+    for feature in features or ():
+        tag = " ".join(search_terms(feature))
+        if tag:
+            bits |= 1 << (int.from_bytes(hashlib.blake2b(tag.encode(), digest_size=8).digest(), "big") % 64)
+    return bits
+
+def popcount(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    return POPCOUNT[bits.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class SimilarIndex:
+    """Column-per-feature arrays over every car, addressed by slot like SearchIndex."""
+
+    def __init__(self):
+        self.slots = {}
+        self.ids = []
+        self.summaries = []
+        self.codes = {name: {} for name in SIMILAR_CATEGORICAL_FIELDS + ("status",)}
+        self.capacity = 0
+        self.columns = {}
+        self._grow(1024)
+        self._scale = None
+
+    def _grow(self, capacity: int):
+        def resized(name, dtype, fill):
+            column = self.columns.get(name, np.zeros(0, dtype=dtype))
+            grown = np.full(capacity, fill, dtype=dtype)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+        
+        resized("alive", bool, False)
+        for name in SIMILAR_NUMERIC_FIELDS:
+            resized(name, np.float32, 0.0)
+        for name in SIMILAR_CATEGORICAL_FIELDS + ("status",):
+            resized(name, np.int32, -1)
+        resized("features", np.uint64, 0)
+        resized("feature_count", np.uint8, 0)
+        self.capacity = capacity
+
+    def add(self, car: dict):
+        self.remove(car["id"])
+        slot = len(self.ids)
+        if slot == self.capacity:
+            self._grow(self.capacity * 2)
+        self.ids.append(car["id"])
+        self.slots[car["id"]] = slot
+        summary = {name: car.get(name) for name in SIMILAR_SUMMARY_FIELDS}
+        summary["images"] = (car.get("images") or [])[:1]
+        self.summaries.append(summary)
+        
+        columns = self.columns
+        columns["alive"][slot] = True
+        for name in SIMILAR_NUMERIC_FIELDS:
+            value = max(car.get(name) or 0, 0)
+            columns[name][slot] = math.log1p(value) if name in SIMILAR_LOG_FIELDS else value
+        for name in SIMILAR_CATEGORICAL_FIELDS + ("status",):
+            value = car.get(name)
+            if value is not None:
+                codes = self.codes[name]
+                columns[name][slot] = codes.setdefault(value, len(codes))
+        bits = feature_bits(car.get("features"))
+        columns["features"][slot] = bits
+        columns["feature_count"][slot] = bin(bits).count("1")
+        self._scale = None
+
+    def remove(self, car_id: str):
+        slot = self.slots.pop(car_id, None)
+        if slot is None:
+            return
+        self.columns["alive"][slot] = False
+        self.summaries[slot] = None
+        self._scale = None
+        if len(self.ids) - len(self.slots) > max(1024, len(self.slots)):
+            live = np.flatnonzero(self.columns["alive"][:len(self.ids)])
+            count = len(live)
+            self.ids = [self.ids[slot] for slot in live]
+            self.summaries = [self.summaries[slot] for slot in live]
+            self.slots = {car_id: slot for slot, car_id in enumerate(self.ids)}
+            for column in self.columns.values():
+                column[:count] = column[live]
+            self.columns["alive"][count:] = False
+
+    def similar(self, car_id: str, limit: int) -> Optional[list]:
+        """Summaries of the `limit` unsold cars closest to `car_id`, or None."""
+        slot = self.slots.get(car_id)
+        if slot is None:
+            return None
+        size = len(self.ids)
+        columns = {name: column[:size] for name, column in self.columns.items()}
+        alive = columns["alive"]
+        if self._scale is None:
+            self._scale = {}
+            for name in SIMILAR_NUMERIC_FIELDS:
+                spread = columns[name][alive].std()
+                self._scale[name] = np.float32(1.0 / spread if spread > 0 else 1.0)
+        
+        distance = np.zeros(size, dtype=np.float32)
+        for name in SIMILAR_NUMERIC_FIELDS:
+            column = columns[name]
+            distance += ((column - column[slot]) * self._scale[name]) ** 2
+        scores = np.float32(SIMILAR_WEIGHTS["numeric"]) / (1 + np.sqrt(distance))
+        for name in SIMILAR_CATEGORICAL_FIELDS:
+            column = columns[name]
+            if column[slot] >= 0:
+                scores[column == column[slot]] += SIMILAR_WEIGHTS[name]
+        features = columns["features"]
+        if features[slot]:
+            counts = columns["feature_count"]
+            weight = np.float32(SIMILAR_WEIGHTS["features"]) * INVERSE_SQRT[counts[slot]]
+            scores += popcount(features & features[slot]) * INVERSE_SQRT[counts] * weight
+        
+        candidates = alive.copy()
+        candidates[slot] = False
+        sold = self.codes["status"].get("sold")
+        if sold is not None:
+            candidates &= columns["status"] != sold
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.summaries[index] for index in order]
+
+
+# ============ CATALOG INDEXES ============
+
+# The search and similarity indexes live in each worker's memory. A worker
+# loads them once, applies its own writes directly, and picks up other
+# workers' writes by re-reading cars whose updated_at moved since its last
+# sync whenever the catalog version changes. Deletes leave a tombstone in
+# `db.car_tombstones` that the same sync applies; tombstones expire after
+# CATALOG_TOMBSTONE_TTL, so a worker that has not synced for longer than
+# that reloads everything instead. Full loads build fresh indexes in a
+# thread, CATALOG_LOAD_BATCH cars at a time, and swap them in when done;
+# requests keep using the previous indexes meanwhile. Writers stamp
+# updated_at right before the write, so CATALOG_SYNC_SLACK only has to
+# cover clock skew and write latency.
+CATALOG_SYNC_SLACK = 5.0
+CATALOG_LOAD_BATCH = 1000
+CATALOG_TOMBSTONE_TTL = int(os.environ.get("CATALOG_TOMBSTONE_TTL", str(7 * 24 * 3600)))
+
+class CatalogIndexes:
+    def __init__(self, projection: dict, **factories):
+        self.factories = factories
+        self.indexes = {name: factory() for name, factory in factories.items()}
+        self.projection = projection
+        self.version = None
+        self.synced_at = None
+        self._lock = asyncio.Lock()
+
+    def __getitem__(self, name: str):
+        return self.indexes[name]
+
+    def add(self, car: dict):
+        for index in self.indexes.values():
+            index.add(car)
+
+    def remove(self, car_id: str):
+        for index in self.indexes.values():
+            index.remove(car_id)
+
+    @staticmethod
+    def _load(indexes: dict, cars: list):
+        for car in cars:
+            for index in indexes.values():
+                index.add(car)
+
+    async def _full_load(self):
+        indexes = {name: factory() for name, factory in self.factories.items()}
+        batch = []
+        async for car in db.cars.find({}, self.projection).batch_size(CATALOG_LOAD_BATCH):
+            batch.append(car)
+            if len(batch) >= CATALOG_LOAD_BATCH:
+                await asyncio.to_thread(self._load, indexes, batch)
+                batch = []
+        await asyncio.to_thread(self._load, indexes, batch)
+        # Own writes that landed on the old indexes during the load bumped
+        # the catalog version, so the next sync's delta picks them up again.
+        self.indexes = indexes
+
+    async def tombstone(self, car_id: str):
+        now = datetime.now(timezone.utc)
+        await db.car_tombstones.update_one(
+            {"_id": car_id},
+            {"$set": {"deleted_at": now, "expires_at": now + timedelta(seconds=CATALOG_TOMBSTONE_TTL)}},
+            upsert=True,
+        )
+
+    async def sync(self, version: int):
+        if self.version == version:
+            return
+        if self._lock.locked() and self.version is not None:
+            return  # a reload is running; answer from the indexes we have
+        async with self._lock:
+            if self.version == version:
+                return
+            started = time.time()
+            if self.synced_at is None or started - self.synced_at > CATALOG_TOMBSTONE_TTL - CATALOG_SYNC_SLACK:
+                await self._full_load()
+            else:
+                since = datetime.fromtimestamp(self.synced_at - CATALOG_SYNC_SLACK, timezone.utc)
+                async for car in db.cars.find({"updated_at": {"$gte": since}}, self.projection):
+                    self.add(car)
+                async for tombstone in db.car_tombstones.find({"deleted_at": {"$gte": since}}, {"_id": 1}):
+                    self.remove(tombstone["_id"])
+            self.version = version
+            self.synced_at = started
+
+catalog_indexes = CatalogIndexes({**SEARCH_PROJECTION, **SIMILAR_PROJECTION}, search=SearchIndex, similar=SimilarIndex)
+
+# ============ PRICING ANALYTICS ============
+
+# Dashboard pricing views are materialized in `db.pricing`, one document per
+# brand and body type plus an "all" document. Car writes queue the groups
+# they touch in `db.pricing_dirty`; the refresh job recomputes just those
+# groups, and rebuilds everything (including "all") every
+# PRICING_FULL_REFRESH_INTERVAL seconds. Only the worker holding the
+# pricing lease in `db.meta` runs the job, and the pandas work runs in a
+# thread so it does not stall the event loop.
+PRICING_REFRESH_INTERVAL = int(os.environ.get("PRICING_REFRESH_INTERVAL", "60"))
+PRICING_FULL_REFRESH_INTERVAL = int(os.environ.get("PRICING_FULL_REFRESH_INTERVAL", "3600"))
+PRICING_DIMENSIONS = {"brand": "brand_key", "body_type": "body_type"}
+PRICING_PROJECTION = {"_id": 0, "brand": 1, "brand_key": 1, "body_type": 1, "price": 1, "year": 1, "mileage": 1, "status": 1}
+PRICING_PERCENTILES = {"p10": 0.1, "p25": 0.25, "p50": 0.5, "p75": 0.75, "p90": 0.9}
+PRICING_MILEAGE_BUCKETS = [0, 10000, 25000, 50000, 75000, 100000, 150000]
+
+def _number(value) -> Optional[float]:
+    return None if pd.isna(value) else round(float(value), 4)
+
+def pricing_metrics(frame: pd.DataFrame, year: int) -> dict:
+    price = frame["price"].astype(float)
+    mileage = frame["mileage"].astype(float)
+    by_status = price.groupby(frame["status"])
+    
+    bounds = PRICING_MILEAGE_BUCKETS + [np.inf]
+    # observed=False keeps one row per bucket so each row lines up with its
+    # upper bound; empty buckets are dropped afterwards.
+    buckets = price.groupby(pd.cut(mileage, bounds, right=False, labels=PRICING_MILEAGE_BUCKETS), observed=False)
+    mileage_curve = [
+        {"min": int(low), "max": None if high == np.inf else high, "count": int(row["count"]), "median_price": _number(row["median"])}
+        for (low, row), high in zip(buckets.agg(["count", "median"]).iterrows(), bounds[1:])
+        if row["count"]
+    ]
+    
+    ages = price.groupby((year - frame["year"]).clip(lower=0)).agg(["count", "median"])
+    newest = ages["median"].iloc[0] if len(ages) else np.nan
+    depreciation = [
+        {"age": int(age), "count": int(row["count"]), "median_price": _number(row["median"]),
+         "retained": _number(row["median"] / newest if newest else np.nan)}
+        for age, row in ages.iterrows()
+    ]
+    
+    medians = by_status.median()
+    available = medians.get("available", np.nan)
+    sold = medians.get("sold", np.nan)
+    driven = mileage > 0
+    return {
+        "count": len(frame),
+        "status": {status: int(count) for status, count in by_status.size().items()},
+        "price": {
+            "mean": _number(price.mean()),
+            **{name: _number(value) for name, value in zip(PRICING_PERCENTILES, price.quantile(list(PRICING_PERCENTILES.values())))},
+        },
+        "price_per_km": _number((price[driven] / mileage[driven]).median()),
+        "mileage_curve": mileage_curve,
+        "depreciation": depreciation,
+        "sold_gap": {
+            "available_median": _number(available),
+            "sold_median": _number(sold),
+            "gap": _number(available - sold),
+            "gap_pct": _number((available - sold) / available if available else np.nan),
+        },
+    }
+
+def pricing_doc(dimension: str, key: str, frame: pd.DataFrame, now: datetime) -> dict:
+    label = frame["brand"].mode().iat[0] if dimension == "brand" else key
+    return {
+        "_id": f"{dimension}:{key}",
+        "dimension": dimension,
+        "key": key,
+        "label": label,
+        **pricing_metrics(frame, now.year),
+        "computed_at": now,
+    }
+
+async def mark_pricing_dirty(cars) -> None:
+    markers = {
+        f"{dimension}:{car[field]}": (dimension, car[field])
+        for car in cars for dimension, field in PRICING_DIMENSIONS.items() if car and car.get(field)
+    }
+    if not markers:
+        return
+    now = datetime.now(timezone.utc)
+    await db.pricing_dirty.bulk_write([
+        UpdateOne({"_id": marker}, {"$set": {"dimension": dimension, "key": key, "marked_at": now}}, upsert=True)
+        for marker, (dimension, key) in markers.items()
+    ], ordered=False)
+
+def pricing_docs(cars: list, now: datetime) -> list:
+    frame = pd.DataFrame(cars)
+    if not len(frame):
+        return []
+    docs = [pricing_doc("all", "all", frame, now)]
+    for dimension, field in PRICING_DIMENSIONS.items():
+        docs += [pricing_doc(dimension, key, group, now) for key, group in frame.groupby(field)]
+    return docs
+
+async def rebuild_pricing() -> int:
+    now = datetime.now(timezone.utc)
+    cars = await db.cars.find({}, PRICING_PROJECTION).to_list(None)
+    docs = await asyncio.to_thread(pricing_docs, cars, now)
+    await db.pricing_dirty.delete_many({"marked_at": {"$lte": now}})
+    if docs:
+        await db.pricing.bulk_write([UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True) for doc in docs])
+    await db.pricing.delete_many({"computed_at": {"$lt": now}})
+    return len(docs)
+
+async def refresh_pricing(full: bool = False) -> int:
+    """Recompute dirty pricing groups (or everything) and return how many docs changed."""
+    overall = await db.pricing.find_one({"_id": "all:all"}, {"computed_at": 1})
+    stale = overall is None or (
+        datetime.now(timezone.utc) - overall["computed_at"]
+    ).total_seconds() >= PRICING_FULL_REFRESH_INTERVAL
+    if full or stale:
+        return await rebuild_pricing()
+    
+    refreshed = 0
+    async for marker in db.pricing_dirty.find():
+        dimension, key = marker["dimension"], marker["key"]
+        now = datetime.now(timezone.utc)
+        cars = await db.cars.find({PRICING_DIMENSIONS[dimension]: key}, PRICING_PROJECTION).to_list(None)
+        if cars:
+            doc = await asyncio.to_thread(lambda: pricing_doc(dimension, key, pd.DataFrame(cars), now))
+            await db.pricing.update_one({"_id": doc["_id"]}, {"$set": doc}, upsert=True)
+        else:
+            await db.pricing.delete_one({"_id": marker["_id"]})
+        # A write that re-marked the group mid-refresh keeps its marker
+        await db.pricing_dirty.delete_one({"_id": marker["_id"], "marked_at": marker["marked_at"]})
+        refreshed += 1
+    return refreshed
+
+LEASE_OWNER = uuid.uuid4().hex
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    """Take or renew the named lease in db.meta; False while another worker holds it."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.meta.update_one(
+            {"_id": f"lease:{name}", "$or": [{"owner": LEASE_OWNER}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": LEASE_OWNER, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False  # the upsert collided with a live lease held elsewhere
+    return True
+
+async def pricing_refresh_loop():
+    while True:
+        try:
+            # The lease outlives a couple of missed runs before another worker takes over
+            if await acquire_lease("pricing", PRICING_REFRESH_INTERVAL * 3):
+                await refresh_pricing()
+        except Exception:
+            logger.exception("Pricing analytics refresh failed")
+        await asyncio.sleep(PRICING_REFRESH_INTERVAL)
+
 # ============ CAR ROUTES ============
 
 @api_router.get("/")
 async def root():
     return {"message": "Velocità Motors API"}
 
-@api_router.post("/cars", response_model=Car)
+def duplicate_stock_number(stock_number: Optional[str]) -> HTTPException:
+    return HTTPException(status_code=409, detail=f"Stock number {stock_number!r} is already in use")
+
+def car_update_fields(car_update: CarUpdate) -> dict:
+    update_data = {k: v for k, v in car_update.model_dump().items() if v is not None}
+    if "stock_number" in car_update.model_fields_set and car_update.stock_number is None:
+        update_data["stock_number"] = None  # an explicit null or blank clears it
+    return update_data
+
+@api_router.post("/cars", response_model=Car, dependencies=[Depends(require_admin)])
 async def create_car(car: CarCreate):
     car_obj = Car(**car.model_dump())
+    car_obj.images = await externalize_images(car_obj.images)
+    car_obj.created_at = car_obj.updated_at = datetime.now(timezone.utc)  # after the image uploads
     doc = car_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.cars.insert_one(doc)
+    doc['brand_key'] = brand_key(doc['brand'])
+    try:
+        await db.cars.insert_one(doc)
+    except DuplicateKeyError:
+        raise duplicate_stock_number(doc["stock_number"])
+    await bump_stats("cars", after=doc)
+    await touch_catalog()
+    await mark_pricing_dirty([doc])
+    catalog_indexes.add(doc)
     return car_obj
 
-@api_router.get("/cars", response_model=List[Car])
-async def get_cars(
+def car_filters(
     brand: Optional[str] = None,
     body_type: Optional[str] = None,
     fuel_type: Optional[str] = None,
@@ -130,12 +2087,14 @@ async def get_cars(
     max_mileage: Optional[int] = None,
     status: Optional[str] = None,
     is_featured: Optional[bool] = None,
-    limit: int = 100
-):
+    brand_exact: bool = False,
+) -> dict:
     query = {}
     
     if brand:
-        query["brand"] = {"$regex": brand, "$options": "i"}
+        key = brand_key(brand)
+        # An anchored, case-sensitive prefix regex on brand_key can use the index
+        query["brand_key"] = key if brand_exact else {"$regex": "^" + re.escape(key)}
     if body_type:
         query["body_type"] = body_type
     if fuel_type:
@@ -153,8 +2112,6 @@ async def get_cars(
             query["price"]["$gte"] = min_price
         if max_price is not None:
             query["price"]["$lte"] = max_price
-        if not query["price"]:
-            del query["price"]
     
     if min_year is not None or max_year is not None:
         query["year"] = {}
@@ -162,8 +2119,6 @@ async def get_cars(
             query["year"]["$gte"] = min_year
         if max_year is not None:
             query["year"]["$lte"] = max_year
-        if not query["year"]:
-            del query["year"]
     
     if min_mileage is not None or max_mileage is not None:
         query["mileage"] = {}
@@ -171,139 +2126,706 @@ async def get_cars(
             query["mileage"]["$gte"] = min_mileage
         if max_mileage is not None:
             query["mileage"]["$lte"] = max_mileage
-        if not query["mileage"]:
-            del query["mileage"]
     
-    cars = await db.cars.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    return query
+
+# Listings are ordered newest first with `id` as a tiebreaker, so a cursor is
+# just the (created_at, id) of the last car on the previous page.
+CAR_SORT = [("created_at", -1), ("id", -1)]
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"].isoformat(), doc["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, car_id = json.loads(raw)
+        if not isinstance(car_id, str):
+            raise ValueError(cursor)
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, car_id
+
+def after_cursor(query: dict, cursor: str) -> dict:
+    created_at, car_id = decode_cursor(cursor)
+    keyset = {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": car_id}},
+    ]}
+    return {"$and": [query, keyset]} if query else keyset
+
+# `fields=summary` returns CarSummary rows; `fields=a,b,c` returns just those
+# Car fields (plus id). Either way the projection is pushed into the find.
+SUMMARY_PROJECTION = {
+    **{name: 1 for name in CarSummary.model_fields if name != "thumbnail"},
+    "images": {"$slice": 1},
+    "_id": 0,
+}
+
+def car_projection(fields: Optional[str], paged: bool = False) -> Optional[dict]:
+    if not fields:
+        return None
+    if fields == "summary":
+        return SUMMARY_PROJECTION
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - set(Car.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    names |= {"id", "created_at"} if paged else {"id"}
+    return {**{name: 1 for name in names}, "_id": 0}
+
+def projected_response(fields: str, payload, paged: bool = False) -> Response:
+    if fields == "summary":
+        return fast_json(_summary_page if paged else _summary_list, payload)
+    body = (_projected_page if paged else _projected_list).dump_json(payload)
+    return Response(content=body, media_type="application/json")
+
+CAR_PAGE_MAX = int(os.environ.get("CAR_PAGE_MAX", "500"))
+
+@api_router.get("/cars", response_model=Union[List[Car], CarPage])
+async def get_cars(
+    request: Request,
+    response: Response,
+    query: dict = Depends(car_filters),
+    limit: int = Query(100, ge=1, le=CAR_PAGE_MAX),
+    paginate: bool = False,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    # Plain requests keep returning a bare list; `paginate` or a `cursor`
+    # switches to the keyset-paginated envelope with `next_cursor`.
+    headers = listing_cache_headers(await catalog_version(), request)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
     
-    for car in cars:
-        if isinstance(car.get('created_at'), str):
-            car['created_at'] = datetime.fromisoformat(car['created_at'])
-        if isinstance(car.get('updated_at'), str):
-            car['updated_at'] = datetime.fromisoformat(car['updated_at'])
+    if cursor:
+        query = after_cursor(query, cursor)
+    paged = paginate or cursor is not None
+    projection = car_projection(fields, paged)
     
-    return cars
+    cars = await db.cars.find(query, projection or {"_id": 0}).sort(CAR_SORT).to_list(limit + 1 if paged else limit)
+    
+    next_cursor = None
+    if paged and len(cars) > limit:
+        cars = cars[:limit]
+        next_cursor = encode_cursor(cars[-1])
+    
+    payload = {"items": cars, "next_cursor": next_cursor} if paged else cars
+    if projection is not None:
+        projected = projected_response(fields, payload, paged)
+        projected.headers.update(headers)
+        return projected
+    if FAST_RESPONSES:
+        return fast_json(_car_page if paged else _car_list, payload, headers)
+    response.headers.update(headers)
+    return payload
 
 @api_router.get("/cars/featured", response_model=List[Car])
-async def get_featured_cars():
-    cars = await db.cars.find({"is_featured": True, "status": "available"}, {"_id": 0}).to_list(10)
-    for car in cars:
-        if isinstance(car.get('created_at'), str):
-            car['created_at'] = datetime.fromisoformat(car['created_at'])
-        if isinstance(car.get('updated_at'), str):
-            car['updated_at'] = datetime.fromisoformat(car['updated_at'])
+async def get_featured_cars(request: Request, response: Response, fields: Optional[str] = None):
+    version = await catalog_version()
+    headers = listing_cache_headers(version, request)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    # Keyed by version: the cache is per worker, so another worker's write
+    # must not leave this one serving old rows under the new ETag.
+    projection = car_projection(fields)
+    cars = await cache.get_or_load(
+        f"cars:featured:{version}:{fields or ''}",
+        lambda: db.cars.find({"is_featured": True, "status": "available"}, projection or {"_id": 0}).to_list(10),
+    )
+    if projection is not None:
+        projected = projected_response(fields, cars)
+        projected.headers.update(headers)
+        return projected
+    if FAST_RESPONSES:
+        return fast_json(_car_list, cars, headers)
+    response.headers.update(headers)
     return cars
 
 @api_router.get("/cars/brands")
 async def get_brands():
-    brands = await db.cars.distinct("brand")
-    return brands
+    return await cache.get_or_load("cars:brands", lambda: db.cars.distinct("brand"))
 
 @api_router.get("/cars/stats")
 async def get_car_stats():
-    total = await db.cars.count_documents({})
-    available = await db.cars.count_documents({"status": "available"})
-    sold = await db.cars.count_documents({"status": "sold"})
-    reserved = await db.cars.count_documents({"status": "reserved"})
-    featured = await db.cars.count_documents({"is_featured": True})
+    return await cache.get_or_load("cars:stats", lambda: read_stats("cars"))
+
+@api_router.get("/cars/search", response_model=CarSearchPage)
+async def search_cars(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    query: dict = Depends(car_filters),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    version = await catalog_version()
+    headers = listing_cache_headers(version, request)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
     
-    return {
-        "total": total,
-        "available": available,
-        "sold": sold,
-        "reserved": reserved,
-        "featured": featured
-    }
+    await catalog_indexes.sync(version)
+    total, ranked = catalog_indexes["search"].search(q, query, offset + limit)
+    ranked = ranked[offset:]
+    found = await db.cars.find({"id": {"$in": ranked}}, {"_id": 0}).to_list(len(ranked))
+    by_id = {car["id"]: car for car in found}
+    for car_id in ranked:
+        if car_id not in by_id:
+            # Deleted by another worker since this index last synced
+            catalog_indexes.remove(car_id)
+            total -= 1
+    
+    payload = {"items": [by_id[car_id] for car_id in ranked if car_id in by_id], "total": total}
+    if FAST_RESPONSES:
+        return fast_json(_search_page, payload, headers)
+    response.headers.update(headers)
+    return payload
+
+# Each facet counts cars matching every filter except its own, so the
+# sidebar keeps showing the alternatives to a value that is already picked.
+FACET_FIELDS = {"brand": "brand_key", "body_type": "body_type", "fuel_type": "fuel_type", "transmission": "transmission"}
+FACET_BUCKETS = {
+    "price": [0, 25000, 50000, 75000, 100000, 150000, 200000, 300000],
+    "year": [1900, 2000, 2005, 2010, 2015, 2018, 2020, 2022, 2024, 2026],
+    "mileage": [0, 10000, 25000, 50000, 75000, 100000, 150000],
+}
+
+def facet_pipeline(query: dict) -> list:
+    faceted = set(FACET_FIELDS.values()) | set(FACET_BUCKETS)
+    shared = {name: condition for name, condition in query.items() if name not in faceted}
+    
+    def excluding(field: str) -> list:
+        rest = {name: condition for name, condition in query.items() if name in faceted and name != field}
+        return [{"$match": rest}] if rest else []
+    
+    facets = {"total": excluding(None) + [{"$count": "count"}]}
+    for name, field in FACET_FIELDS.items():
+        facets[name] = excluding(field) + [
+            {"$group": {"_id": f"${name}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+        ]
+    for name, boundaries in FACET_BUCKETS.items():
+        facets[name] = excluding(name) + [
+            {"$bucket": {"groupBy": f"${name}", "boundaries": boundaries, "default": "above", "output": {"count": {"$sum": 1}}}},
+        ]
+    return [{"$match": shared}, {"$facet": facets}]
+
+def facet_counts(result: dict) -> dict:
+    counts = {"total": result["total"][0]["count"] if result["total"] else 0}
+    for name in FACET_FIELDS:
+        counts[name] = [{"value": row["_id"], "count": row["count"]} for row in result[name] if row["_id"] is not None]
+    for name, boundaries in FACET_BUCKETS.items():
+        # The last boundary opens an unbounded top bucket, which $bucket
+        # reports under its default id.
+        by_bound = {row["_id"]: row["count"] for row in result[name]}
+        by_bound[boundaries[-1]] = by_bound.pop("above", 0)
+        counts[name] = [
+            {"min": low, "max": high, "count": by_bound.get(low, 0)}
+            for low, high in zip(boundaries, boundaries[1:] + [None])
+        ]
+    return counts
+
+@api_router.get("/cars/facets")
+async def get_car_facets(request: Request, response: Response, query: dict = Depends(car_filters)):
+    version = await catalog_version()
+    headers = listing_cache_headers(version, request)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    async def load():
+        result = await db.cars.aggregate(facet_pipeline(query)).to_list(1)
+        return facet_counts(result[0])
+    
+    key = json.dumps(query, sort_keys=True, separators=(",", ":"))
+    facets = await cache.get_or_load(f"cars:facets:{version}:{key}", load)
+    response.headers.update(headers)
+    return facets
+
+@api_router.get("/cars/{car_id}/similar", response_model=List[CarSummary])
+async def get_similar_cars(car_id: str, limit: int = Query(6, ge=1, le=24)):
+    # The version is read through the cache, so steady-state requests are
+    # answered from memory; other workers' writes show up within CACHE_TTL.
+    await catalog_indexes.sync(await cache.get_or_load("cars:version", catalog_version))
+    cars = catalog_indexes["similar"].similar(car_id, limit)
+    if cars is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+    return fast_json(_summary_list, cars)
 
 @api_router.get("/cars/{car_id}", response_model=Car)
-async def get_car(car_id: str):
+async def get_car(car_id: str, request: Request, response: Response):
     car = await db.cars.find_one({"id": car_id}, {"_id": 0})
     if not car:
         raise HTTPException(status_code=404, detail="Car not found")
     
-    if isinstance(car.get('created_at'), str):
-        car['created_at'] = datetime.fromisoformat(car['created_at'])
-    if isinstance(car.get('updated_at'), str):
-        car['updated_at'] = datetime.fromisoformat(car['updated_at'])
-    
+    headers = car_cache_headers(car)
+    if etag_matches(request, headers["ETag"]) or not_modified_since(request, car["updated_at"]):
+        return Response(status_code=304, headers=headers)
+    if FAST_RESPONSES:
+        return fast_json(_car, car, headers)
+    response.headers.update(headers)
     return car
 
-@api_router.put("/cars/{car_id}", response_model=Car)
-async def update_car(car_id: str, car_update: CarUpdate):
-    existing = await db.cars.find_one({"id": car_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Car not found")
-    
-    update_data = {k: v for k, v in car_update.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.cars.update_one({"id": car_id}, {"$set": update_data})
+@api_router.put("/cars/{car_id}", response_model=Car, dependencies=[Depends(require_admin)])
+async def update_car(
+    car_id: str,
+    car_update: CarUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    update_data = car_update_fields(car_update)
+    if "brand" in update_data:
+        update_data["brand_key"] = brand_key(update_data["brand"])
+    if "images" in update_data:
+        update_data["images"] = await externalize_images(update_data["images"])
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    updated_car = await db.cars.find_one({"id": car_id}, {"_id": 0})
-    if isinstance(updated_car.get('created_at'), str):
-        updated_car['created_at'] = datetime.fromisoformat(updated_car['created_at'])
-    if isinstance(updated_car.get('updated_at'), str):
-        updated_car['updated_at'] = datetime.fromisoformat(updated_car['updated_at'])
+    # BEFORE gives the old status/is_featured for the stats counters; the
+    # new document is exactly the old one with the $set/$inc applied.
+    try:
+        previous = await db.cars.find_one_and_update(
+            {"id": car_id, **if_match_filter(car_id, if_match)},
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE,
+        )
+    except DuplicateKeyError:
+        raise duplicate_stock_number(update_data.get("stock_number"))
+    if previous is None:
+        await missing_or_stale("cars", car_id, "Car not found", if_match)
     
+    updated_car = {**previous, **update_data, "version": previous.get("version", 0) + 1}
+    await bump_stats("cars", before=previous, after=updated_car)
+    await touch_catalog()
+    await mark_pricing_dirty([previous, updated_car])
+    catalog_indexes.add(updated_car)
+    response.headers.update(car_cache_headers(updated_car))
     return updated_car
 
-@api_router.delete("/cars/{car_id}")
+@api_router.delete("/cars/{car_id}", dependencies=[Depends(require_admin)])
 async def delete_car(car_id: str):
-    result = await db.cars.delete_one({"id": car_id})
-    if result.deleted_count == 0:
+    deleted = await db.cars.find_one_and_delete(
+        {"id": car_id}, {"_id": 0, "status": 1, "is_featured": 1, "brand_key": 1, "body_type": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Car not found")
+    await bump_stats("cars", before=deleted)
+    await catalog_indexes.tombstone(car_id)
+    await touch_catalog()
+    known_cars.invalidate(car_id)
+    await mark_pricing_dirty([deleted])
+    catalog_indexes.remove(car_id)
     return {"message": "Car deleted successfully"}
 
+# ============ BULK IMPORT ============
+
+# Imports stream the body (raw CSV/NDJSON, or a multipart `file` field),
+# validate each row with CarCreate and write unordered bulk_write batches.
+# Rows with a stock_number upsert on it; the rest are plain inserts.
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+IMPORT_LIST_FIELDS = ("features", "images")
+
+async def iter_upload_chunks(upload):
+    while chunk := await upload.read(IMAGE_CHUNK_SIZE):
+        yield chunk
+
+IMPORT_MAX_RECORD_LINES = 100
+
+def decode_line(raw: bytes) -> tuple:
+    try:
+        return raw.decode("utf-8").rstrip("\r"), None
+    except UnicodeDecodeError as exc:
+        return None, f"Not valid UTF-8 at byte {exc.start}"
+
+async def iter_lines(chunks):
+    # Lines are split as bytes (0x0A never occurs inside a UTF-8 sequence)
+    # and decoded one by one, so a bad line is reported rather than fatal.
+    buffer = b""
+    first = True
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if first:
+                line = line.removeprefix(codecs.BOM_UTF8)
+                first = False
+            yield decode_line(line)
+    if first:
+        buffer = buffer.removeprefix(codecs.BOM_UTF8)
+    if buffer.strip():
+        yield decode_line(buffer)
+
+async def iter_ndjson_rows(lines):
+    row = 0
+    async for line, error in lines:
+        if error:
+            row += 1
+            yield row, None, error
+            continue
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield row, None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(data, dict):
+            yield row, None, "Expected a JSON object"
+            continue
+        yield row, data, None
+
+def csv_quote_open(text: str) -> bool:
+    """Whether text ends inside a quoted field, following csv's default dialect.
+
+    A quote only opens a field at its very start; one in the middle of an
+    unquoted field (`Alloy 19" wheels`) is literal.
+    """
+    quoted = False
+    field_start = True
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if quoted:
+            if char == '"':
+                if text[index + 1:index + 2] == '"':
+                    index += 1
+                else:
+                    quoted = False
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char in ",\n"
+        index += 1
+    return quoted
+
+class CsvRecords:
+    """Groups lines into CSV records, joining lines inside a quoted field.
+
+    A record still open after IMPORT_MAX_RECORD_LINES lines is reported as
+    unterminated and the lines after its first are read again, so one bad
+    quote costs one row instead of the rest of the file.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def feed(self, line: str) -> list:
+        self.pending.append(line)
+        text = "\n".join(self.pending)
+        if not csv_quote_open(text):
+            self.pending = []
+            return [(text, None)]
+        if len(self.pending) <= IMPORT_MAX_RECORD_LINES:
+            return []
+        _, *rest = self.pending
+        self.pending = []
+        records = [(None, "Unterminated quoted field")]
+        for line in rest:
+            records += self.feed(line)
+        return records
+
+    def finish(self) -> list:
+        if not self.pending:
+            return []
+        _, *rest = self.pending
+        self.pending = []
+        records = [(None, "Unterminated quoted field")]
+        for line in rest:
+            records += self.feed(line)
+        return records + self.finish()
+
+async def iter_csv_rows(lines):
+    header = None
+    records = CsvRecords()
+    row = 0
+    
+    def parse(text, error):
+        nonlocal header, row
+        if error is None:
+            try:
+                values = next(csv.reader([text]), [])
+            except csv.Error as exc:
+                error = f"Invalid CSV: {exc}"
+        if header is None:
+            # Nothing has been written yet, so a bad header fails the request
+            if error:
+                raise HTTPException(status_code=400, detail=f"Invalid CSV header: {error}")
+            header = [name.strip() for name in values]
+            return None
+        if error:
+            row += 1
+            return row, None, error
+        if not any(value.strip() for value in values):
+            return None
+        row += 1
+        data = {
+            name: value.strip()
+            for name, value in zip(header, values) if name and value.strip()
+        }
+        for name in IMPORT_LIST_FIELDS:
+            if name in data:
+                data[name] = [item.strip() for item in data[name].split("|") if item.strip()]
+        return row, data, None
+    
+    async for line, error in lines:
+        if error:
+            records.pending = []  # an undecodable line spoils the record it belongs to
+            parsed = [(None, error)]
+        else:
+            parsed = records.feed(line)
+        for text, record_error in parsed:
+            result = parse(text, record_error)
+            if result:
+                yield result
+    for text, record_error in records.finish():
+        result = parse(text, record_error)
+        if result:
+            yield result
+
+def import_operation(car: CarCreate, now: datetime):
+    doc = car.model_dump()
+    doc["brand_key"] = brand_key(doc["brand"])
+    doc["updated_at"] = now
+    if not car.stock_number:
+        return InsertOne({**doc, "id": str(uuid.uuid4()), "created_at": now})
+    # An upsert only overwrites the columns the row supplied; model defaults
+    # (status, images, is_featured, ...) apply to newly created cars only.
+    provided = {**car.model_dump(exclude_unset=True), "brand_key": doc["brand_key"], "updated_at": now}
+    defaults = {name: value for name, value in doc.items() if name not in provided}
+    return UpdateOne(
+        {"stock_number": car.stock_number},
+        {
+            "$set": provided,
+            "$setOnInsert": {**defaults, "id": str(uuid.uuid4()), "created_at": now},
+            "$inc": {"version": 1},
+        },
+        upsert=True,
+    )
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.upserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def add_result(self, details: dict):
+        self.inserted += details.get("nInserted", 0)
+        self.upserted += details.get("nUpserted", 0)
+        self.updated += details.get("nModified", 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted + self.upserted,
+            "updated": self.updated,
+            "failed": self.error_count,
+            "errors": self.errors,
+        }
+
+async def flush_import(batch: list, report: ImportReport):
+    if not batch:
+        return
+    # Stamped at write time, not parse time: other workers' catalog index
+    # syncs only look a few seconds behind their last sync for updated_at.
+    now = datetime.now(timezone.utc)
+    try:
+        result = await db.cars.bulk_write([import_operation(car, now) for _, car in batch], ordered=False)
+        report.add_result(result.bulk_api_result)
+    except BulkWriteError as exc:
+        report.add_result(exc.details)
+        for error in exc.details.get("writeErrors", []):
+            report.error(batch[error["index"]][0], error.get("errmsg", "Write failed"))
+
+def import_format(request: Request, format: Optional[str], filename: Optional[str]) -> str:
+    hint = (format or filename or request.headers.get("content-type", "")).lower()
+    if "csv" in hint:
+        return "csv"
+    if "json" in hint:
+        return "ndjson"
+    raise HTTPException(status_code=415, detail="Import must be CSV or NDJSON")
+
+@api_router.post("/cars/import", dependencies=[Depends(require_admin)])
+async def import_cars(request: Request, format: Optional[str] = None):
+    form = None
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing file")
+        kind = import_format(request, format, upload.filename or upload.content_type)
+        chunks = iter_upload_chunks(upload)
+    else:
+        kind = import_format(request, format, None)
+        chunks = request.stream()
+    
+    rows = iter_csv_rows(iter_lines(chunks)) if kind == "csv" else iter_ndjson_rows(iter_lines(chunks))
+    report = ImportReport()
+    batch = []
+    groups = {}
+    try:
+        async for row, data, error in rows:
+            report.rows += 1
+            if error:
+                report.error(row, error)
+                continue
+            try:
+                car = CarCreate(**data)
+            except ValidationError as exc:
+                report.error(row, "; ".join(
+                    f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in exc.errors()
+                ))
+                continue
+            if car.images:
+                # Cars only keep image URLs: inline images move to GridFS and
+                # rows with any other non-URL value are refused
+                car.images = await externalize_images(car.images)
+                if not all(image.startswith(IMAGE_URL_PREFIXES) for image in car.images):
+                    report.error(row, "images: inline images must be JPEG, PNG, GIF or WebP; other values must be URLs")
+                    continue
+            batch.append((row, car))
+            key = brand_key(car.brand)
+            groups[(key, car.body_type)] = {"brand_key": key, "body_type": car.body_type}
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush_import(batch, report)
+                batch = []
+        await flush_import(batch, report)
+    finally:
+        if form is not None:
+            await form.close()
+    
+    if report.inserted or report.upserted or report.updated:
+        await touch_catalog()
+        await mark_pricing_dirty(groups.values())
+        if STATS_MODE == "counters":
+            await check_stats("cars", repair=True)
+    return report.as_dict()
+
+# ============ BULK UPDATES ============
+
+@api_router.patch("/cars/bulk", dependencies=[Depends(require_admin)])
+async def bulk_update_cars(payload: CarBulkUpdate):
+    ids = [op.id for op in payload.operations]
+    existing = {
+        car["id"]: car
+        async for car in db.cars.find(
+            {"id": {"$in": ids}}, {"_id": 0, "id": 1, "status": 1, "is_featured": 1, "brand_key": 1, "body_type": 1}
+        )
+    }
+    
+    failed = []
+    planned = []
+    seen = set()
+    for op in payload.operations:
+        if op.id in seen:
+            failed.append({"id": op.id, "error": "Duplicate id in request"})
+            continue
+        seen.add(op.id)
+        if op.id not in existing:
+            failed.append({"id": op.id, "error": "Car not found"})
+            continue
+        update_data = car_update_fields(op.update)
+        if "brand" in update_data:
+            update_data["brand_key"] = brand_key(update_data["brand"])
+        if "images" in update_data:
+            update_data["images"] = await externalize_images(update_data["images"])
+        planned.append((op.id, update_data))
+    
+    matched = modified = 0
+    written = {car_id for car_id, _ in planned}
+    if planned:
+        # Stamped after the image uploads, right before the write
+        now = datetime.now(timezone.utc)
+        for _, update in planned:
+            update["updated_at"] = now
+        requests = [
+            UpdateOne({"id": car_id}, {"$set": update, "$inc": {"version": 1}}) for car_id, update in planned
+        ]
+        try:
+            result = await db.cars.bulk_write(requests, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as exc:
+            details = exc.details
+            for error in details.get("writeErrors", []):
+                car_id = planned[error["index"]][0]
+                written.discard(car_id)
+                failed.append({"id": car_id, "error": error.get("errmsg", "Write failed")})
+        matched = details.get("nMatched", 0)
+        modified = details.get("nModified", 0)
+    
+    if written:
+        await bump_stats_many("cars", [
+            (existing[car_id], {**existing[car_id], **update})
+            for car_id, update in planned if car_id in written
+        ])
+        await touch_catalog()
+        await mark_pricing_dirty(
+            car for car_id, update in planned if car_id in written
+            for car in (existing[car_id], update)
+        )
+    return {"matched": matched, "modified": modified, "failed": failed}
+
 # ============ INQUIRY ROUTES ============
 
 @api_router.post("/inquiries", response_model=Inquiry)
 async def create_inquiry(inquiry: InquiryCreate):
-    # Verify car exists
-    car = await db.cars.find_one({"id": inquiry.car_id})
-    if not car:
+    if not await car_exists(inquiry.car_id):
         raise HTTPException(status_code=404, detail="Car not found")
     
     inquiry_obj = Inquiry(**inquiry.model_dump())
     doc = inquiry_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    if WRITE_BEHIND:
+        write_queues["inquiries"].submit(doc)
+        return inquiry_obj
     await db.inquiries.insert_one(doc)
+    await inquiries_flushed([doc])
     return inquiry_obj
 
-@api_router.get("/inquiries", response_model=List[Inquiry])
+@api_router.get("/inquiries", response_model=List[Inquiry], dependencies=[Depends(require_admin)])
 async def get_inquiries(status: Optional[str] = None):
     query = {}
     if status:
         query["status"] = status
     
     inquiries = await db.inquiries.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for inq in inquiries:
-        if isinstance(inq.get('created_at'), str):
-            inq['created_at'] = datetime.fromisoformat(inq['created_at'])
+    if FAST_RESPONSES:
+        return fast_json(_inquiry_list, inquiries)
     return inquiries
 
-@api_router.put("/inquiries/{inquiry_id}/status")
-async def update_inquiry_status(inquiry_id: str, status: str):
-    result = await db.inquiries.update_one(
-        {"id": inquiry_id},
-        {"$set": {"status": status}}
+@api_router.put("/inquiries/{inquiry_id}/status", dependencies=[Depends(require_admin)])
+async def update_inquiry_status(
+    inquiry_id: str,
+    status: str,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    previous = await db.inquiries.find_one_and_update(
+        {"id": inquiry_id, **if_match_filter(inquiry_id, if_match)},
+        {"$set": {"status": status}, "$inc": {"version": 1}},
+        projection={"_id": 0, "status": 1, "version": 1},
+        return_document=ReturnDocument.BEFORE,
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Inquiry not found")
-    return {"message": "Status updated"}
+    if previous is None:
+        await missing_or_stale("inquiries", inquiry_id, "Inquiry not found", if_match)
+    await bump_stats("inquiries", before=previous, after={"status": status})
+    cache.invalidate("inquiries:")
+    version = previous.get("version", 0) + 1
+    response.headers["ETag"] = resource_etag(inquiry_id, version)
+    return {"message": "Status updated", "version": version}
 
-@api_router.get("/inquiries/stats")
+@api_router.get("/inquiries/stats", dependencies=[Depends(require_admin)])
 async def get_inquiry_stats():
-    total = await db.inquiries.count_documents({})
-    new_count = await db.inquiries.count_documents({"status": "new"})
-    contacted = await db.inquiries.count_documents({"status": "contacted"})
-    closed = await db.inquiries.count_documents({"status": "closed"})
-    
-    return {
-        "total": total,
-        "new": new_count,
-        "contacted": contacted,
-        "closed": closed
-    }
+    return await cache.get_or_load("inquiries:stats", lambda: read_stats("inquiries"))
 
 # ============ CONTACT ROUTES ============
 
@@ -311,18 +2833,240 @@ async def get_inquiry_stats():
 async def create_contact(contact: ContactMessage):
     contact_obj = ContactMessageDB(**contact.model_dump())
     doc = contact_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    if WRITE_BEHIND:
+        write_queues["contacts"].submit(doc)
+        return contact_obj
     await db.contacts.insert_one(doc)
     return contact_obj
 
-@api_router.get("/contacts", response_model=List[ContactMessageDB])
+@api_router.get("/contacts", response_model=List[ContactMessageDB], dependencies=[Depends(require_admin)])
 async def get_contacts():
     contacts = await db.contacts.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    for c in contacts:
-        if isinstance(c.get('created_at'), str):
-            c['created_at'] = datetime.fromisoformat(c['created_at'])
+    if FAST_RESPONSES:
+        return fast_json(_contact_list, contacts)
     return contacts
 
+# ============ EXPORT ROUTES ============
+
+# Exports stream straight off the Motor cursor in EXPORT_BATCH_SIZE chunks,
+# so memory stays flat regardless of collection size. CSV list columns are
+# '|'-joined, matching what /cars/import accepts.
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+EXPORT_FORMAT = Query("ndjson", pattern="^(ndjson|csv)$")
+
+def created_range(created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> dict:
+    bounds = {}
+    if created_from is not None:
+        bounds["$gte"] = created_from
+    if created_to is not None:
+        bounds["$lte"] = created_to
+    return {"created_at": bounds} if bounds else {}
+
+async def export_chunks(collection: str, query: dict, model, format: str):
+    adapter = TypeAdapter(model)
+    columns = list(model.model_fields)
+    cursor = db[collection].find(query, {"_id": 0}).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    chunk = bytearray()
+    if format == "csv":
+        writer.writerow(columns)
+    pending = 0
+    async for doc in cursor:
+        item = adapter.validate_python(doc)
+        if format == "csv":
+            row = adapter.dump_python(item, mode="json")
+            writer.writerow([
+                "|".join(value) if isinstance(value, list) else value
+                for value in (row.get(column) for column in columns)
+            ])
+        else:
+            chunk += adapter.dump_json(item) + b"\n"
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue().encode() if format == "csv" else bytes(chunk)
+            buffer.seek(0)
+            buffer.truncate()
+            chunk.clear()
+            pending = 0
+    yield buffer.getvalue().encode() if format == "csv" else bytes(chunk)
+
+def export_response(collection: str, query: dict, model, format: str) -> StreamingResponse:
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}-{datetime.now(timezone.utc):%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        export_chunks(collection, query, model, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@api_router.get("/export/cars", dependencies=[Depends(require_admin)])
+async def export_cars(
+    query: dict = Depends(car_filters),
+    dates: dict = Depends(created_range),
+    format: str = EXPORT_FORMAT,
+):
+    return export_response("cars", {**query, **dates}, Car, format)
+
+@api_router.get("/export/inquiries", dependencies=[Depends(require_admin)])
+async def export_inquiries(
+    status: Optional[str] = None,
+    dates: dict = Depends(created_range),
+    format: str = EXPORT_FORMAT,
+):
+    query = {"status": status} if status else {}
+    return export_response("inquiries", {**query, **dates}, Inquiry, format)
+
+@api_router.get("/export/contacts", dependencies=[Depends(require_admin)])
+async def export_contacts(dates: dict = Depends(created_range), format: str = EXPORT_FORMAT):
+    return export_response("contacts", dates, ContactMessageDB, format)
+
+# ============ IMAGE ROUTES ============
+
+@api_router.post("/images", dependencies=[Depends(require_admin)])
+async def upload_image(file: UploadFile = File(...)):
+    first_chunk = await file.read(IMAGE_CHUNK_SIZE)
+    content_type = sniff_content_type(first_chunk)
+    if content_type is None:
+        raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF and WebP images are supported")
+    
+    image_id = uuid.uuid4().hex
+    grid_in = images_fs.open_upload_stream_with_id(
+        image_id, file.filename or "image", metadata={"content_type": content_type}
+    )
+    sha256 = hashlib.sha256()
+    chunks = []
+    size = 0
+    chunk = first_chunk
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > IMAGE_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
+            sha256.update(chunk)
+            chunks.append(chunk)
+            await grid_in.write(chunk)
+            chunk = await file.read(IMAGE_CHUNK_SIZE)
+        digest = sha256.hexdigest()
+        await grid_in.set("metadata", {"content_type": content_type, "sha256": digest})
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+    schedule_derivatives(digest, b"".join(chunks))
+    return {
+        "id": image_id,
+        "url": image_url(image_id),
+        "size": size,
+        "variants": {variant: f"{image_url(image_id)}/{variant}" for variant in IMAGE_VARIANTS},
+    }
+
+def parse_range(header: Optional[str], length: int) -> Optional[tuple]:
+    # Only single byte ranges are honoured; anything else is served in full.
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    else:
+        start = max(length - int(last), 0)
+        end = length - 1
+    if start > end or start >= length:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"},
+        )
+    return start, end
+
+async def iter_grid_out(grid_out, start: int, end: int):
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(IMAGE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+@api_router.get("/images/{image_id}")
+async def get_image(image_id: str, request: Request):
+    try:
+        grid_out = await images_fs.open_download_stream(image_id)
+    except gridfs.NoFile:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    length = grid_out.length
+    metadata = grid_out.metadata or {}
+    content_type = metadata.get("content_type")
+    if content_type not in IMAGE_CONTENT_TYPES:
+        content_type = "application/octet-stream"  # stored before uploads were sniffed
+    etag = '"%s"' % metadata.get("sha256", image_id)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "ETag": etag,
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    byte_range = parse_range(request.headers.get("range"), length) if length else None
+    if byte_range is None:
+        start, end, status_code = 0, length - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        iter_grid_out(grid_out, start, end),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers,
+    )
+
+@api_router.get("/images/{image_id}/{variant}")
+async def get_image_variant(image_id: str, variant: str, request: Request):
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    try:
+        original = await images_fs.open_download_stream(image_id)
+    except gridfs.NoFile:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    source = None
+    digest = (original.metadata or {}).get("sha256")
+    if digest is None:
+        source = await original.read()
+        digest = hashlib.sha256(source).hexdigest()
+    
+    etag = f'"{digest}-{variant}"'
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag, "X-Content-Type-Options": "nosniff"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        derivative = await derivatives_fs.open_download_stream(f"{digest}-{variant}")
+    except gridfs.NoFile:
+        pass
+    else:
+        headers["Content-Length"] = str(derivative.length)
+        return StreamingResponse(
+            iter_grid_out(derivative, 0, derivative.length - 1), media_type="image/webp", headers=headers
+        )
+    
+    if source is None:
+        source = await original.read()
+    try:
+        data = await build_derivative(digest, variant, source)
+    except OSError:
+        raise HTTPException(status_code=415, detail="Image cannot be resized")
+    return Response(content=data, media_type="image/webp", headers=headers)
+
 # ============ ADMIN AUTH ============
 
 ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
@@ -330,13 +3074,87 @@ ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "velocita2024")
 
 @api_router.post("/admin/login")
 async def admin_login(credentials: AdminLogin):
-    if credentials.username == ADMIN_USERNAME and credentials.password == ADMIN_PASSWORD:
-        return {"success": True, "message": "Login successful"}
+    valid = hmac.compare_digest(credentials.username.encode(), ADMIN_USERNAME.encode())
+    valid &= hmac.compare_digest(credentials.password.encode(), ADMIN_PASSWORD.encode())
+    if valid:
+        return {"success": True, "message": "Login successful", **issue_session(credentials.username)}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
+@api_router.post("/admin/refresh")
+async def admin_refresh(authorization: Optional[str] = Header(None)):
+    # Refresh tokens are single use: the presented one is revoked
+    claims = await token_verifier.verify(bearer_token(authorization), kind="refresh")
+    await token_verifier.revoke(claims)
+    return issue_session(claims["sub"])
+
+@api_router.post("/admin/logout")
+async def admin_logout(
+    claims: dict = Depends(require_admin),
+    refresh_token: Optional[str] = Body(None, embed=True),
+):
+    revoked = [claims]
+    if refresh_token:
+        revoked.append(await token_verifier.verify(refresh_token, kind="refresh"))
+    await token_verifier.revoke(*revoked)
+    return {"message": "Logged out"}
+
+@api_router.get("/admin/cache", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    return {**cache.stats(), "known_cars": known_cars.stats()}
+
+@api_router.get("/admin/rate-limits", dependencies=[Depends(require_admin)])
+async def get_rate_limit_stats():
+    return {"enabled": RATE_LIMITING, "limits": RATE_LIMITS, **rate_limiter.stats()}
+
+@api_router.get("/admin/write-queues", dependencies=[Depends(require_admin)])
+async def get_write_queue_stats():
+    return {name: writer.stats() for name, writer in write_queues.items()}
+
+@api_router.get("/admin/stats/check", dependencies=[Depends(require_admin)])
+async def get_stats_check(repair: bool = False):
+    return [await check_stats(collection, repair=repair) for collection in STAT_BUCKETS]
+
+@api_router.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries():
+    return slow_queries.report()
+
+@api_router.delete("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def clear_slow_queries():
+    slow_queries.samples.clear()
+    slow_queries.explained.clear()
+    return {"message": "Slow query log cleared"}
+
+@api_router.get("/admin/indexes", dependencies=[Depends(require_admin)])
+async def get_index_report():
+    return await index_report()
+
+@api_router.get("/admin/pricing", dependencies=[Depends(require_admin)])
+async def get_pricing_overview():
+    doc = await db.pricing.find_one({"_id": "all:all"}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Pricing analytics not computed yet")
+    return doc
+
+@api_router.get("/admin/pricing/{dimension}", dependencies=[Depends(require_admin)])
+async def get_pricing_groups(dimension: str):
+    if dimension not in PRICING_DIMENSIONS:
+        raise HTTPException(status_code=404, detail="Unknown pricing dimension")
+    return await db.pricing.find({"dimension": dimension}, {"_id": 0}).sort("count", -1).to_list(None)
+
+@api_router.get("/admin/pricing/{dimension}/{key}", dependencies=[Depends(require_admin)])
+async def get_pricing_group(dimension: str, key: str):
+    if dimension not in PRICING_DIMENSIONS:
+        raise HTTPException(status_code=404, detail="Unknown pricing dimension")
+    if dimension == "brand":
+        key = brand_key(key)
+    doc = await db.pricing.find_one({"_id": f"{dimension}:{key}"}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="No cars in this group")
+    return doc
+
 # ============ SEED DATA ============
 
-@api_router.post("/seed")
+@api_router.post("/seed", dependencies=[Depends(require_admin)])
 async def seed_database():
     # Check if data already exists
     existing = await db.cars.count_documents({})
@@ -516,18 +3334,27 @@ async def seed_database():
         }
     ]
     
+    docs = []
     for car_data in sample_cars:
         car_obj = Car(**car_data)
         doc = car_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['updated_at'] = doc['updated_at'].isoformat()
+        doc['brand_key'] = brand_key(doc['brand'])
         await db.cars.insert_one(doc)
+        await bump_stats("cars", after=doc)
+        catalog_indexes.add(doc)
+        docs.append(doc)
+    await touch_catalog()
+    await mark_pricing_dirty(docs)
     
     return {"message": "Database seeded successfully", "count": len(sample_cars)}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+if RATE_LIMITING:
+    # Added before CORS so throttled responses still carry CORS headers
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, limits=RATE_LIMITS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -536,13 +3363,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+if METRICS_ENABLED:
+    # Outermost, so the timings include CORS and rate limiting
+    app.add_middleware(MetricsMiddleware, routes=app.routes)
+    
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=generate_latest(METRICS_REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+@app.on_event("startup")
+async def startup_check_admin_secret():
+    if not ADMIN_TOKEN_SECRET:
+        raise RuntimeError("ADMIN_TOKEN_SECRET must be set to a secret shared by all workers")
+
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    if os.environ.get("AUTO_INDEXES", "true").lower() != "true":
+        return
+    try:
+        await ensure_indexes()
+    except Exception:
+        logger.exception("Index bootstrap failed")
+
+@app.on_event("startup")
+async def startup_slow_query_log():
+    slow_queries.loop = asyncio.get_running_loop()
+
+@app.on_event("startup")
+async def startup_stats_check():
+    if STATS_MODE == "counters" and STATS_CHECK_INTERVAL > 0:
+        app.state.stats_check_task = asyncio.create_task(stats_check_loop())
+
+@app.on_event("startup")
+async def startup_catalog_indexes():
+    async def warm():
+        try:
+            await catalog_indexes.sync(await catalog_version())
+        except Exception:
+            logger.exception("Catalog index warmup failed")
+    
+    task = asyncio.create_task(warm())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def startup_pricing_refresh():
+    if PRICING_REFRESH_INTERVAL > 0:
+        app.state.pricing_refresh_task = asyncio.create_task(pricing_refresh_loop())
+
+@app.on_event("startup")
+async def startup_write_queues():
+    if WRITE_BEHIND:
+        for writer in write_queues.values():
+            writer.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for writer in write_queues.values():
+        await writer.stop()
     client.close()
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
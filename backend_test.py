@@ -11,6 +11,7 @@ class CarDealershipAPITester:
         self.test_results = []
         self.created_car_id = None
         self.created_inquiry_id = None
+        self.admin_token = None
 
     def log_result(self, test_name, success, details="", response_data=None):
         """Log test result"""
@@ -33,6 +34,8 @@ class CarDealershipAPITester:
         url = f"{self.base_url}/{endpoint}" if endpoint else self.base_url
         if headers is None:
             headers = {'Content-Type': 'application/json'}
+            if self.admin_token:
+                headers['Authorization'] = f"Bearer {self.admin_token}"
 
         print(f"\n🔍 Testing {name}...")
         
@@ -105,6 +108,18 @@ class CarDealershipAPITester:
         
         return success1 and success2 and success3 and success4
 
+    def test_car_pagination(self):
+        """Test cursor pagination through the inventory"""
+        success, page = self.run_test("Paginate Cars (First Page)", "GET", "cars?paginate=true&limit=3", 200)
+        success0, _ = self.run_test("Paginate Cars (Zero Limit)", "GET", "cars?paginate=true&limit=0", 422)
+        success = success and success0
+        if not success or not isinstance(page, dict) or not page.get('next_cursor'):
+            return success
+        
+        success2, _ = self.run_test("Paginate Cars (Next Page)", "GET", f"cars?cursor={page['next_cursor']}&limit=3", 200)
+        success3, _ = self.run_test("Paginate Cars (Invalid Cursor)", "GET", "cars?cursor=not-a-cursor", 400)
+        return success2 and success3
+
     def test_create_car(self):
         """Test creating a new car"""
         car_data = {
@@ -209,7 +224,9 @@ class CarDealershipAPITester:
             "username": "admin",
             "password": "velocita2024"
         }
-        success1, _ = self.run_test("Admin Login (Valid)", "POST", "admin/login", 200, valid_creds)
+        success1, response_data = self.run_test("Admin Login (Valid)", "POST", "admin/login", 200, valid_creds)
+        if success1 and isinstance(response_data, dict):
+            self.admin_token = response_data.get("access_token")
         
         # Test invalid credentials
         invalid_creds = {
@@ -220,6 +237,19 @@ class CarDealershipAPITester:
         
         return success1 and success2
 
+    def test_admin_auth_required(self):
+        """Test that admin routes reject missing or bad tokens"""
+        headers = {'Content-Type': 'application/json'}
+        success1, _ = self.run_test("Create Car (No Token)", "POST", "cars", 401, {}, headers=headers)
+        
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer not-a-token'}
+        success2, _ = self.run_test("Seed Database (Bad Token)", "POST", "seed", 401, headers=headers)
+        
+        headers = {'Content-Type': 'application/json'}
+        success3, _ = self.run_test("Get Inquiries (No Token)", "GET", "inquiries", 401, headers=headers)
+        
+        return success1 and success2 and success3
+
     def test_delete_car(self):
         """Test deleting a car (cleanup)"""
         if not self.created_car_id:
@@ -235,6 +265,11 @@ class CarDealershipAPITester:
         
         # Basic API tests
         self.test_root_endpoint()
+        
+        # Admin tests (log in first; write routes need the token)
+        self.test_admin_login()
+        self.test_admin_auth_required()
+        
         self.test_seed_database()
         
         # Car-related tests
@@ -243,6 +278,7 @@ class CarDealershipAPITester:
         self.test_get_brands()
         self.test_get_car_stats()
         self.test_car_filters()
+        self.test_car_pagination()
         
         # CRUD operations
         self.test_create_car()
@@ -259,9 +295,6 @@ class CarDealershipAPITester:
         self.test_contact_form()
         self.test_get_contacts()
         
-        # Admin tests
-        self.test_admin_login()
-        
         # Cleanup
         self.test_delete_car()
         
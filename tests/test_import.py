@@ -0,0 +1,94 @@
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+import server  # noqa: E402
+from server import CarCreate, import_operation, iter_csv_rows, iter_lines  # noqa: E402
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HEADER = b"brand,model,description\n"
+ROW = {
+    "brand": "Porsche", "model": "911", "year": 2021, "price": 120000, "mileage": 8000,
+    "fuel_type": "Petrol", "transmission": "Automatic", "body_type": "Coupe",
+    "color": "Guards Red", "engine": "3.0L", "description": "Clean",
+}
+
+
+def test_row_without_stock_number_is_a_plain_insert():
+    op = import_operation(CarCreate(**ROW), NOW)
+    doc = op._doc
+    assert doc["brand_key"] == "porsche"
+    assert doc["status"] == "available"
+    assert doc["created_at"] == doc["updated_at"] == NOW
+    assert doc["id"]
+
+
+def test_upsert_sets_only_supplied_columns():
+    op = import_operation(CarCreate(**ROW, stock_number="S1", status="sold"), NOW)
+    assert op._filter == {"stock_number": "S1"}
+    update = op._doc
+    assert set(update["$set"]) == set(ROW) | {"stock_number", "status", "brand_key", "updated_at"}
+    on_insert = update["$setOnInsert"]
+    assert {"images", "features", "is_featured"} <= set(on_insert)
+    assert "status" not in on_insert
+    assert not set(update["$set"]) & set(on_insert)
+    assert update["$inc"] == {"version": 1}
+    assert op._upsert
+
+
+def csv_rows(data: bytes, chunk_size: int = 7) -> list:
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def collect():
+        return [row async for row in iter_csv_rows(iter_lines(chunks()))]
+
+    return asyncio.run(collect())
+
+
+def test_csv_quoted_field_spans_lines():
+    rows = csv_rows(HEADER + b'A,B,"two\nlines ""quoted"""\r\nC,D,ok')
+    assert rows == [
+        (1, {"brand": "A", "model": "B", "description": 'two\nlines "quoted"'}, None),
+        (2, {"brand": "C", "model": "D", "description": "ok"}, None),
+    ]
+
+
+def test_csv_stray_quotes_are_literal():
+    rows = csv_rows(HEADER + b'A,B,Alloy 19" wheels\nC,D,19" and 20"\nE,F,ok\n')
+    assert [data["description"] for _, data, _ in rows] == ['Alloy 19" wheels', '19" and 20"', "ok"]
+
+
+def test_csv_unterminated_quote_costs_one_row(monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_MAX_RECORD_LINES", 2)
+    rows = csv_rows(HEADER + b'A,B,"never closed\nC,D,ok\nE,F,ok\nG,H,ok\n')
+    assert rows[0] == (1, None, "Unterminated quoted field")
+    assert [data["brand"] for _, data, _ in rows[1:]] == ["C", "E", "G"]
+
+
+def test_csv_unterminated_quote_at_end_of_file():
+    rows = csv_rows(HEADER + b'A,B,"never closed\nC,D,ok\n')
+    assert rows == [(1, None, "Unterminated quoted field"), (2, {"brand": "C", "model": "D", "description": "ok"}, None)]
+
+
+def test_csv_undecodable_row_is_reported():
+    rows = csv_rows(b"\xef\xbb\xbf" + HEADER + b"A,B,caf\xe9\nC,D,ok\n")
+    assert rows == [(1, None, "Not valid UTF-8 at byte 7"), (2, {"brand": "C", "model": "D", "description": "ok"}, None)]
+
+
+def test_csv_undecodable_header_is_rejected():
+    with pytest.raises(HTTPException) as info:
+        csv_rows(b"br\xe9nd\nA\n")
+    assert info.value.status_code == 400
+
+
+def test_csv_list_fields_split_on_pipes():
+    rows = csv_rows(b"brand,images\nA, /a.jpg | /b.jpg |\n")
+    assert rows == [(1, {"brand": "A", "images": ["/a.jpg", "/b.jpg"]}, None)]
@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import pricing_metrics  # noqa: E402
+
+
+def make_frame(rows):
+    return pd.DataFrame(rows, columns=["price", "year", "mileage", "status"])
+
+
+def test_mileage_curve_skips_empty_buckets():
+    frame = make_frame([
+        (90000, 2022, 30000, "available"),
+        (70000, 2021, 60000, "available"),
+    ])
+    curve = pricing_metrics(frame, 2024)["mileage_curve"]
+    assert curve == [
+        {"min": 25000, "max": 50000, "count": 1, "median_price": 90000.0},
+        {"min": 50000, "max": 75000, "count": 1, "median_price": 70000.0},
+    ]
+
+
+def test_mileage_curve_open_ended_top_bucket():
+    frame = make_frame([
+        (20000, 2010, 5000, "available"),
+        (10000, 2010, 200000, "available"),
+    ])
+    curve = pricing_metrics(frame, 2024)["mileage_curve"]
+    assert [(point["min"], point["max"]) for point in curve] == [(0, 10000), (150000, None)]
+
+
+def test_single_age_group():
+    frame = make_frame([
+        (100000, 2024, 1000, "available"),
+        (120000, 2024, 2000, "sold"),
+    ])
+    depreciation = pricing_metrics(frame, 2024)["depreciation"]
+    assert depreciation == [{"age": 0, "count": 2, "median_price": 110000.0, "retained": 1.0}]
+
+
+def test_no_sold_cars():
+    frame = make_frame([
+        (50000, 2020, 40000, "available"),
+        (70000, 2022, 0, "available"),
+    ])
+    metrics = pricing_metrics(frame, 2024)
+    assert metrics["status"] == {"available": 2}
+    assert metrics["sold_gap"] == {
+        "available_median": 60000.0,
+        "sold_median": None,
+        "gap": None,
+        "gap_pct": None,
+    }
+    assert metrics["price_per_km"] == 1.25